@@ -3,10 +3,16 @@ Authentication module for HelperGPT
 Handles admin login, JWT tokens, and user verification
 """
 
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple, Iterable
 import os
-from passlib.context import CryptContext
+import re
+import json
+import time
+import hmac
+import hashlib
+import bcrypt
 from jose import JWTError, jwt
 from fastapi import HTTPException, status
 import logging
@@ -19,8 +25,16 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing; pick rounds so one hash takes ~250ms on production hardware
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a plain password against its hash"""
+    return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+
+def get_password_hash(password: str) -> str:
+    """Generate hash for a password"""
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
 
 # JWT configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
@@ -31,29 +45,36 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "password123")
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a plain password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+# Verified token cache: sha256(token) -> (claims, monotonic expiry)
+JWT_CACHE_MAX_ENTRIES = int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000"))
+JWT_CACHE_TTL_SECONDS = float(os.getenv("JWT_CACHE_TTL_SECONDS", "5"))
+_JWT_ALGORITHMS = [ALGORITHM]
+_JWT_DECODE_OPTIONS = {"verify_signature": True, "require_exp": True, "require_sub": True}
+_jwt_cache: "OrderedDict[bytes, Tuple[Dict[str, Any], float]]" = OrderedDict()
 
-def get_password_hash(password: str) -> str:
-    """Generate hash for a password"""
-    return pwd_context.hash(password)
+# Hash the admin password once; ADMIN_PASSWORD_HASH skips hashing at import
+_ADMIN_HASH = os.getenv("ADMIN_PASSWORD_HASH") or get_password_hash(ADMIN_PASSWORD)
+
+_ADMIN_USER = {
+    "id": 1,
+    "username": ADMIN_USERNAME,
+    "role": "admin",
+    "full_name": "System Administrator",
+    "email": "admin@company.com",
+    "is_active": True,
+    "created_at": datetime.now().isoformat()
+}
 
 async def authenticate_admin(username: str, password: str) -> Optional[Dict[str, Any]]:
     """Authenticate admin user"""
     try:
         # In production, query database for user
-        if username == ADMIN_USERNAME and password == ADMIN_PASSWORD:
-            return {
-                "id": 1,
-                "username": username,
-                "role": "admin",
-                "full_name": "System Administrator",
-                "email": "admin@company.com",
-                "is_active": True,
-                "created_at": datetime.now().isoformat()
-            }
-        return None
+        if not hmac.compare_digest(username.encode(), ADMIN_USERNAME.encode()):
+            return None
+        if not verify_password(password, _ADMIN_HASH):
+            return None
+        # A copy, so callers that annotate the user can't change it for every later login
+        return dict(_ADMIN_USER)
     except Exception as e:
         logger.error(f"Authentication error: {str(e)}")
         return None
@@ -79,10 +100,43 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
             detail="Could not create access token"
         )
 
+def _get_cached_claims(key: bytes) -> Optional[Dict[str, Any]]:
+    """Return cached claims for a token hash if still fresh"""
+    entry = _jwt_cache.get(key)
+    if entry is None:
+        return None
+
+    payload, expires_at = entry
+    if expires_at <= time.monotonic():
+        del _jwt_cache[key]
+        return None
+
+    _jwt_cache.move_to_end(key)
+    return payload
+
+def _cache_claims(key: bytes, payload: Dict[str, Any]):
+    """Cache successfully verified claims, never outliving the token's exp"""
+    ttl = JWT_CACHE_TTL_SECONDS
+    exp = payload.get("exp")
+    if exp is not None:
+        ttl = min(ttl, float(exp) - time.time())
+    if ttl <= 0:
+        return
+
+    _jwt_cache[key] = (payload, time.monotonic() + ttl)
+    _jwt_cache.move_to_end(key)
+    while len(_jwt_cache) > JWT_CACHE_MAX_ENTRIES:
+        _jwt_cache.popitem(last=False)
+
 async def verify_token(token: str) -> Optional[Dict[str, Any]]:
     """Verify and decode JWT token"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        cache_key = hashlib.sha256(token.encode()).digest()
+        payload = _get_cached_claims(cache_key)
+        if payload is None:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=_JWT_ALGORITHMS, options=_JWT_DECODE_OPTIONS)
+            _cache_claims(cache_key, payload)
+
         username = payload.get("sub")
         role = payload.get("role")
 
@@ -107,8 +161,8 @@ async def verify_token(token: str) -> Optional[Dict[str, Any]]:
         return None
 
 def hash_admin_password() -> str:
-    """Generate hashed version of admin password for secure storage"""
-    return get_password_hash(ADMIN_PASSWORD)
+    """Return hashed version of admin password for secure storage"""
+    return _ADMIN_HASH
 
 async def get_current_admin_user(credentials: HTTPAuthorizationCredentials = None) -> Dict[str, Any]:
     """Get current authenticated admin user"""
@@ -140,7 +194,65 @@ def require_admin_role(user: Dict[str, Any]) -> bool:
 async def validate_admin_session(token: str) -> bool:
     """Validate admin session and return True if valid"""
     try:
-        user = await verify_token(token)
-        return user is not None and require_admin_role(user)
+        # verify_token only returns a user for admin-role tokens
+        return await verify_token(token) is not None
     except Exception:
         return False
+
+_UNAUTHORIZED_BODY = json.dumps({"detail": "Could not validate credentials"}).encode()
+_UNAUTHORIZED_START = {
+    "type": "http.response.start",
+    "status": status.HTTP_401_UNAUTHORIZED,
+    "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(_UNAUTHORIZED_BODY)).encode()),
+        (b"www-authenticate", b"Bearer"),
+    ],
+}
+_UNAUTHORIZED_BODY_MESSAGE = {"type": "http.response.body", "body": _UNAUTHORIZED_BODY}
+
+class AdminAuthASGIMiddleware:
+    """Pure ASGI admin token check for protected routes
+
+    Reads the bearer token straight from scope["headers"] and answers with a
+    pre-encoded 401 on failure. The verified user is stored in
+    scope["state"]["user"] (request.state.user in handlers).
+    """
+
+    def __init__(self, app, protected_prefixes: Iterable[str] = ("/admin",),
+                 protected_routes: Iterable[Tuple[str, str]] = ()):
+        self.app = app
+        self.protected_prefixes = tuple(protected_prefixes)
+        self.protected_routes = [
+            (method.upper(), re.compile(pattern)) for method, pattern in protected_routes
+        ]
+
+    def is_protected(self, method: str, path: str) -> bool:
+        """Check whether a request must carry an admin token"""
+        if path.startswith(self.protected_prefixes):
+            return True
+        return any(
+            method == route_method and pattern.match(path)
+            for route_method, pattern in self.protected_routes
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.is_protected(scope["method"], scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                if value[:7].lower() == b"bearer ":
+                    token = value[7:].decode("latin-1").strip()
+                break
+
+        user = await verify_token(token) if token else None
+        if user is None:
+            await send(_UNAUTHORIZED_START)
+            await send(_UNAUTHORIZED_BODY_MESSAGE)
+            return
+
+        scope.setdefault("state", {})["user"] = user
+        await self.app(scope, receive, send)
@@ -3,11 +3,17 @@ Conversation Handler Module for HelperGPT Support Case Extension
 Manages interactive conversations and follow-up questions for support cases
 """
 import os
-import json
 import uuid
+import time
+import heapq
+import orjson
+import asyncio
+import hashlib
 import logging
-from typing import Dict, List, Any, Optional
-from datetime import datetime, timedelta
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Any, Optional, Tuple
+from datetime import datetime, timezone
 from openai import AsyncAzureOpenAI
 from database import get_db_connection
 
@@ -22,10 +28,167 @@ azure_openai_client = AsyncAzureOpenAI(
 
 GPT_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o")
 
+SESSION_TIMEOUT_SECONDS = 2 * 60 * 60  # In-memory session lifetime
+ARCHIVE_AFTER_SECONDS = 7 * 24 * 60 * 60  # Archive DB sessions after 7 days
+HISTORY_TAIL_SIZE = 10  # Messages of context sent with each AI request
+MAX_CONVERSATION_STATES = int(os.getenv("MAX_CONVERSATION_STATES", "5000"))
+MAX_IN_MEMORY_MESSAGES = 50  # Beyond this, older messages live only in SQLite
+TRIMMED_MESSAGE_COUNT = 20
+
+# JSON mode: the service guarantees a syntactically valid JSON object
+_JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+# System prompts; only the conversation state is substituted per call
+_CTX_SYSTEM_PROMPT_TMPL = """You are an IT support specialist having an interactive conversation with a user.
+Your goal is to gather enough information to either:
+1. Provide helpful troubleshooting steps
+2. Determine if the issue needs to be escalated to a department
+
+Current conversation state: {state}
+
+Guidelines:
+- Ask specific, targeted questions to narrow down the problem
+- Provide safe troubleshooting steps when appropriate
+- Be empathetic and professional
+- If you have enough information, indicate that a support case can be created
+- Limit to 2-3 follow-up questions at a time
+
+Respond with JSON format:
+{{
+    "message": "Your response to the user",
+    "questions": ["Question 1", "Question 2"],
+    "next_action": "continue|create_case|escalate",
+    "case_ready": true/false,
+    "new_state": "current_state",
+    "extracted_info": {{"key": "value"}},
+    "troubleshooting_steps": ["step1", "step2"] (optional)
+}}
+"""
+
+_EXTRACT_SYSTEM_PROMPT = """You are analyzing a support conversation to extract structured information.
+Extract the following details from the conversation:
+- Issue description (summarized)
+- Issue category (hardware/software/network/security/account_access)
+- Severity level (low/medium/high/critical)
+- User information (if provided)
+- Symptoms mentioned
+- Error messages (if any)
+- When the issue started
+- Steps already tried
+
+Return as JSON format with these keys.
+"""
+
+# AI response cache: blake2b(state + history tail) -> (raw JSON, monotonic expiry)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+_resp_cache: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+
+def _get_cached_response(key: bytes) -> Optional[Dict[str, Any]]:
+    """Return a freshly parsed copy of a cached AI response, if still valid"""
+    entry = _resp_cache.get(key)
+    if entry is None:
+        return None
+
+    raw_response, expires_at = entry
+    if expires_at <= time.monotonic():
+        del _resp_cache[key]
+        return None
+
+    _resp_cache.move_to_end(key)
+    return orjson.loads(raw_response)
+
+def _cache_response(key: bytes, raw_response: str):
+    """Cache the raw JSON so every hit parses into new, unshared objects"""
+    _resp_cache[key] = (raw_response, time.monotonic() + RESPONSE_CACHE_TTL_SECONDS)
+    _resp_cache.move_to_end(key)
+    while len(_resp_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+        _resp_cache.popitem(last=False)
+
+_INSERT_MESSAGE_SQL = """
+    INSERT INTO conversation_messages 
+    (session_id, message_type, content, metadata, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+# Messages by position in the session, for history trimmed from the in-memory window
+_MESSAGES_RANGE_SQL = """
+    SELECT message_type, content FROM conversation_messages
+    WHERE session_id = ?
+    ORDER BY timestamp ASC, id ASC
+    LIMIT ? OFFSET ?
+"""
+
+_UPDATE_STATE_SQL = """
+    UPDATE conversation_sessions 
+    SET conversation_state = ?, updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE session_id = ?
+"""
+
+# Tables created before timestamps became INTEGER epoch columns hold CURRENT_TIMESTAMP text,
+# which compares above every integer in SQLite; convert it once at startup
+_MIGRATE_TEXT_TIMESTAMPS_SQL = tuple(
+    f"""
+    UPDATE {table} SET {column} = CAST(strftime('%s', {column}) AS INTEGER)
+    WHERE typeof({column}) = 'text' AND strftime('%s', {column}) IS NOT NULL
+    """
+    for table, column in (
+        ("conversation_sessions", "created_at"),
+        ("conversation_sessions", "updated_at"),
+        ("conversation_messages", "timestamp"),
+    )
+)
+
+def _to_epoch(value) -> float:
+    """Convert a stored timestamp to epoch seconds
+
+    Tables created before timestamps became INTEGER epoch columns hold
+    CURRENT_TIMESTAMP text (UTC), so both forms are accepted.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+# Pooled SQLite connections shared by all conversation operations
+CONVERSATION_DB_POOL_SIZE = int(os.getenv("CONVERSATION_DB_POOL_SIZE", "4"))
+_pool: Optional[asyncio.Queue] = None
+_pool_lock = asyncio.Lock()
+
+async def _init_pool():
+    """Open the pooled connections once"""
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            return
+
+        pool = asyncio.Queue(maxsize=CONVERSATION_DB_POOL_SIZE)
+        # get_db_connection applies the shared WAL-friendly PRAGMAs
+        for _ in range(CONVERSATION_DB_POOL_SIZE):
+            pool.put_nowait(await get_db_connection())
+        _pool = pool
+        logger.info(f"Conversation DB pool opened with {CONVERSATION_DB_POOL_SIZE} connections")
+
+@asynccontextmanager
+async def _acquire():
+    """Borrow a pooled connection, rolling back anything left uncommitted on error"""
+    if _pool is None:
+        await _init_pool()
+
+    conn = await _pool.get()
+    try:
+        yield conn
+    except Exception:
+        await conn.rollback()
+        raise
+    finally:
+        _pool.put_nowait(conn)
+
 class ConversationHandler:
     def __init__(self):
-        self.conversation_states = {}  # In-memory conversation states
-        self.session_timeout = timedelta(hours=2)  # 2 hour timeout
+        # In-memory conversation states, least recently used first
+        self.conversation_states: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.session_timeout = SESSION_TIMEOUT_SECONDS  # 2 hour timeout
+        self._expiry_heap: List[Tuple[float, str]] = []  # (expiry epoch, session_id)
 
         # Conversation flow states
         self.conversation_flow = {
@@ -58,39 +221,54 @@ class ConversationHandler:
     async def initialize_conversation_tables(self):
         """Initialize conversation-related database tables"""
         try:
-            conn = await get_db_connection()
-
-            # Conversation sessions table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS conversation_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT UNIQUE NOT NULL,
-                    user_name TEXT,
-                    user_email TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    status TEXT DEFAULT 'active',
-                    case_number TEXT,
-                    issue_category TEXT,
-                    conversation_state TEXT DEFAULT 'initial'
-                )
-            """)
-
-            # Conversation messages table
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS conversation_messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT NOT NULL,
-                    message_type TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    metadata TEXT,
-                    FOREIGN KEY (session_id) REFERENCES conversation_sessions (session_id)
-                )
-            """)
+            await _init_pool()
+
+            async with _acquire() as conn:
+                # Conversation sessions table
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS conversation_sessions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        session_id TEXT UNIQUE NOT NULL,
+                        user_name TEXT,
+                        user_email TEXT,
+                        created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                        updated_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                        status TEXT DEFAULT 'active',
+                        case_number TEXT,
+                        issue_category TEXT,
+                        conversation_state TEXT DEFAULT 'initial'
+                    )
+                """)
+
+                # Conversation messages table
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS conversation_messages (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        session_id TEXT NOT NULL,
+                        message_type TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        timestamp INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                        metadata TEXT,
+                        FOREIGN KEY (session_id) REFERENCES conversation_sessions (session_id)
+                    )
+                """)
+
+                # Indexes for per-session message loads and the archival sweep
+                await conn.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_conv_msgs_sid_ts
+                    ON conversation_messages(session_id, timestamp)
+                """)
+
+                await conn.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_conv_sessions_status
+                    ON conversation_sessions(status, created_at)
+                """)
+
+                for sql in _MIGRATE_TEXT_TIMESTAMPS_SQL:
+                    await conn.execute(sql)
+
+                await conn.commit()
 
-            await conn.commit()
-            await conn.close()
             logger.info("Conversation tables initialized successfully")
 
         except Exception as e:
@@ -100,38 +278,43 @@ class ConversationHandler:
     async def start_conversation(self, initial_message: str, user_info: Dict = None) -> Dict[str, Any]:
         """Start a new conversation session"""
         try:
-            session_id = str(uuid.uuid4())
+            session_id = uuid.uuid4().hex
+            created_at = time.time()
 
             # Create session in database
-            conn = await get_db_connection()
-            await conn.execute("""
-                INSERT INTO conversation_sessions 
-                (session_id, user_name, user_email, conversation_state)
-                VALUES (?, ?, ?, 'initial')
-            """, (
-                session_id,
-                user_info.get("user_name") if user_info else None,
-                user_info.get("user_email") if user_info else None
-            ))
-
-            # Store initial message
-            await conn.execute("""
-                INSERT INTO conversation_messages 
-                (session_id, message_type, content)
-                VALUES (?, 'user', ?)
-            """, (session_id, initial_message))
-
-            await conn.commit()
-            await conn.close()
+            async with _acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO conversation_sessions 
+                    (session_id, user_name, user_email, conversation_state, created_at, updated_at)
+                    VALUES (?, ?, ?, 'initial', ?, ?)
+                """, (
+                    session_id,
+                    user_info.get("user_name") if user_info else None,
+                    user_info.get("user_email") if user_info else None,
+                    created_at,
+                    created_at
+                ))
+
+                # Store initial message
+                await conn.execute(_INSERT_MESSAGE_SQL, (session_id, "user", initial_message, None, created_at))
+
+                await conn.commit()
 
             # Initialize in-memory state
-            self.conversation_states[session_id] = {
+            self._remember_state(session_id, {
                 "state": "initial",
-                "messages": [{"type": "user", "content": initial_message, "timestamp": datetime.now()}],
+                "messages": [],
+                "history_tail": deque(maxlen=HISTORY_TAIL_SIZE),
                 "extracted_info": {},
-                "created_at": datetime.now(),
-                "user_info": user_info or {}
-            }
+                "created_at_ts": created_at,
+                "user_info": user_info or {},
+                **self._new_message_counts()
+            })
+            self._append_message(
+                self.conversation_states[session_id],
+                {"type": "user", "content": initial_message, "timestamp": created_at}
+            )
+            self._track_expiry(session_id, created_at)
 
             # Generate initial response
             response = await self.generate_contextual_response(session_id, initial_message)
@@ -159,25 +342,31 @@ class ConversationHandler:
                 # Session not found, start new one
                 return await self.start_conversation(user_message)
 
+            # One timestamp for everything recorded in this turn
+            now_ts = time.time()
+
             # Update conversation state
             conversation = self.conversation_states[session_id]
-            conversation["messages"].append({
+            self._append_message(conversation, {
                 "type": "user",
                 "content": user_message,
-                "timestamp": datetime.now()
+                "timestamp": now_ts
             })
 
-            # Store message in database
-            await self.store_message(session_id, "user", user_message)
-
-            # Generate contextual response
-            response = await self.generate_contextual_response(session_id, user_message)
-
-            # Store bot response
-            await self.store_message(session_id, "bot", response["message"], response.get("metadata"))
+            # Store the user message while the contextual response is generated
+            response, _ = await asyncio.gather(
+                self.generate_contextual_response(session_id, user_message),
+                self.store_message(session_id, "user", user_message, timestamp=now_ts)
+            )
 
-            # Update conversation state in database
-            await self.update_conversation_state(session_id, response.get("new_state", conversation["state"]))
+            # Store the bot reply and the new state in one transaction; this
+            # runs after the user insert so message ids keep turn order
+            await self.store_turn(
+                session_id,
+                [("bot", response["message"], response.get("metadata"))],
+                response.get("new_state", conversation["state"]),
+                timestamp=now_ts
+            )
 
             logger.info(f"Handled conversation for session: {session_id}")
             return {
@@ -204,38 +393,10 @@ class ConversationHandler:
             conversation = self.conversation_states[session_id]
             current_state = conversation["state"]
 
-            # Build conversation history
-            messages_history = "\n".join([
-                f"{msg['type'].title()}: {msg['content']}"
-                for msg in conversation["messages"][-10:]  # Last 10 messages for context
-            ])
+            # Build conversation history from the pre-formatted tail
+            messages_history = "\n".join(conversation["history_tail"])
 
-            system_prompt = f"""
-            You are an IT support specialist having an interactive conversation with a user.
-            Your goal is to gather enough information to either:
-            1. Provide helpful troubleshooting steps
-            2. Determine if the issue needs to be escalated to a department
-
-            Current conversation state: {current_state}
-
-            Guidelines:
-            - Ask specific, targeted questions to narrow down the problem
-            - Provide safe troubleshooting steps when appropriate
-            - Be empathetic and professional
-            - If you have enough information, indicate that a support case can be created
-            - Limit to 2-3 follow-up questions at a time
-
-            Respond with JSON format:
-            {{
-                "message": "Your response to the user",
-                "questions": ["Question 1", "Question 2"],
-                "next_action": "continue|create_case|escalate",
-                "case_ready": true/false,
-                "new_state": "current_state",
-                "extracted_info": {{"key": "value"}},
-                "troubleshooting_steps": ["step1", "step2"] (optional)
-            }}
-            """
+            system_prompt = _CTX_SYSTEM_PROMPT_TMPL.format(state=current_state)
 
             user_prompt = f"""
             Conversation History:
@@ -246,40 +407,37 @@ class ConversationHandler:
             Generate an appropriate response to continue this support conversation.
             """
 
-            response = await azure_openai_client.chat.completions.create(
-                model=GPT_DEPLOYMENT,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=600,
-                temperature=0.4
-            )
-
-            ai_response = response.choices[0].message.content.strip()
+            cache_key = hashlib.blake2b(
+                f"{current_state}|{messages_history[-2000:]}|{user_message}".encode(),
+                digest_size=16
+            ).digest()
+            parsed_response = _get_cached_response(cache_key)
+
+            if parsed_response is None:
+                response = await azure_openai_client.chat.completions.create(
+                    model=GPT_DEPLOYMENT,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    max_tokens=600,
+                    temperature=0.4,
+                    response_format=_JSON_RESPONSE_FORMAT
+                )
 
-            try:
-                parsed_response = json.loads(ai_response)
+                raw_response = response.choices[0].message.content
+                parsed_response = orjson.loads(raw_response)
+                _cache_response(cache_key, raw_response)
 
-                # Update conversation state with extracted info
-                if "extracted_info" in parsed_response:
-                    conversation["extracted_info"].update(parsed_response["extracted_info"])
+            # Update conversation state with extracted info
+            if "extracted_info" in parsed_response:
+                conversation["extracted_info"].update(parsed_response["extracted_info"])
 
-                # Update state
-                if "new_state" in parsed_response and parsed_response["new_state"] != current_state:
-                    conversation["state"] = parsed_response["new_state"]
+            # Update state
+            if "new_state" in parsed_response and parsed_response["new_state"] != current_state:
+                conversation["state"] = parsed_response["new_state"]
 
-                return parsed_response
-
-            except json.JSONDecodeError:
-                logger.warning("Could not parse AI response as JSON, providing fallback")
-                return {
-                    "message": ai_response,
-                    "questions": self.get_fallback_questions(current_state),
-                    "next_action": "continue",
-                    "case_ready": False,
-                    "new_state": current_state
-                }
+            return parsed_response
 
         except Exception as e:
             logger.error(f"Error generating contextual response: {str(e)}")
@@ -291,6 +449,44 @@ class ConversationHandler:
                 "new_state": current_state
             }
 
+    @staticmethod
+    def _format_history_line(message: Dict) -> str:
+        """Format a message the way it appears in the AI prompt history"""
+        return f"{message['type'].title()}: {message['content']}"
+
+    def _remember_state(self, session_id: str, state: Dict[str, Any]):
+        """Insert a session state, evicting the least recently used beyond the cap"""
+        self.conversation_states[session_id] = state
+        self.conversation_states.move_to_end(session_id)
+        while len(self.conversation_states) > MAX_CONVERSATION_STATES:
+            evicted_id, _ = self.conversation_states.popitem(last=False)
+            logger.debug(f"Evicted conversation state from memory: {evicted_id}")
+
+    @staticmethod
+    def _new_message_counts() -> Dict[str, Any]:
+        """Counters read by determine_next_action, kept current on every append"""
+        return {"total_msg_count": 0, "user_msg_count": 0, "has_long_user_msg": False}
+
+    @staticmethod
+    def _count_message(counts: Dict[str, Any], message: Dict):
+        """Fold one message into the running counters"""
+        counts["total_msg_count"] += 1
+        if message["type"] == "user":
+            counts["user_msg_count"] += 1
+            if len(message.get("content", "")) > 20:
+                counts["has_long_user_msg"] = True
+
+    def _append_message(self, conversation: Dict, message: Dict):
+        """Append a message to the in-memory state and its formatted history tail"""
+        messages = conversation["messages"]
+        messages.append(message)
+        conversation["history_tail"].append(self._format_history_line(message))
+        self._count_message(conversation, message)
+
+        # Long conversations keep only a recent window in memory; older messages stay in SQLite
+        if len(messages) > MAX_IN_MEMORY_MESSAGES:
+            del messages[:len(messages) - TRIMMED_MESSAGE_COUNT]
+
     def get_fallback_questions(self, current_state: str) -> List[str]:
         """Get fallback questions based on current state"""
         return self.conversation_flow.get(current_state, {}).get("questions", [
@@ -309,28 +505,41 @@ class ConversationHandler:
             if not conversation:
                 return {}
 
-            # Prepare conversation text for analysis
+            messages = conversation["messages"]
+            total = conversation["total_msg_count"]
+            last_extraction = conversation.get("last_extraction")
+            # Positions count every message in the session, including ones trimmed from memory
+            start = conversation.get("last_extracted_count", 0) if last_extraction is not None else 0
+
+            if start >= total:
+                # Nothing new since the previous extraction
+                extracted_details = dict(last_extraction)
+                extracted_details.update(conversation.get("extracted_info", {}))
+                return extracted_details
+
+            # Only send messages the model has not seen yet, reading any trimmed ones back from SQLite
+            first_in_memory = total - len(messages)
+            new_messages = messages[max(0, start - first_in_memory):]
+            if start < first_in_memory:
+                async with _acquire() as conn:
+                    cursor = await conn.execute(_MESSAGES_RANGE_SQL, (session_id, first_in_memory - start, start))
+                    rows = await cursor.fetchall()
+                new_messages = [{"type": row[0], "content": row[1]} for row in rows] + new_messages
             conversation_text = "\n".join([
                 f"{msg['type']}: {msg['content']}"
-                for msg in conversation["messages"]
+                for msg in new_messages
             ])
 
-            system_prompt = """
-            You are analyzing a support conversation to extract structured information.
-            Extract the following details from the conversation:
-            - Issue description (summarized)
-            - Issue category (hardware/software/network/security/account_access)
-            - Severity level (low/medium/high/critical)
-            - User information (if provided)
-            - Symptoms mentioned
-            - Error messages (if any)
-            - When the issue started
-            - Steps already tried
-
-            Return as JSON format with these keys.
-            """
+            system_prompt = _EXTRACT_SYSTEM_PROMPT
 
-            user_prompt = f"Analyze this conversation and extract issue details:\n{conversation_text}"
+            if last_extraction is not None:
+                user_prompt = (
+                    f"Prior extracted details:\n{orjson.dumps(last_extraction).decode()}\n\n"
+                    f"New messages:\n{conversation_text}\n\n"
+                    "Merge the new messages into the prior details and return the complete updated JSON."
+                )
+            else:
+                user_prompt = f"Analyze this conversation and extract issue details:\n{conversation_text}"
 
             response = await azure_openai_client.chat.completions.create(
                 model=GPT_DEPLOYMENT,
@@ -339,22 +548,19 @@ class ConversationHandler:
                     {"role": "user", "content": user_prompt}
                 ],
                 max_tokens=400,
-                temperature=0.2
+                temperature=0.2,
+                response_format=_JSON_RESPONSE_FORMAT
             )
 
-            ai_response = response.choices[0].message.content.strip()
+            extracted_details = orjson.loads(response.choices[0].message.content)
+            conversation["last_extraction"] = dict(extracted_details)
+            conversation["last_extracted_count"] = total
 
-            try:
-                extracted_details = json.loads(ai_response)
+            # Merge with already extracted info
+            if "extracted_info" in conversation:
+                extracted_details.update(conversation["extracted_info"])
 
-                # Merge with already extracted info
-                if "extracted_info" in conversation:
-                    extracted_details.update(conversation["extracted_info"])
-
-                return extracted_details
-
-            except json.JSONDecodeError:
-                return conversation.get("extracted_info", {})
+            return extracted_details
 
         except Exception as e:
             logger.error(f"Error extracting issue details: {str(e)}")
@@ -369,14 +575,10 @@ class ConversationHandler:
 
             # Check if we have enough information
             extracted_info = conversation.get("extracted_info", {})
-            message_count = len(conversation.get("messages", []))
+            message_count = conversation["total_msg_count"]
 
             # Criteria for creating a case
-            has_description = "issue_description" in extracted_info or any(
-                len(msg.get("content", "")) > 20 
-                for msg in conversation["messages"] 
-                if msg["type"] == "user"
-            )
+            has_description = "issue_description" in extracted_info or conversation["has_long_user_msg"]
 
             has_category = "issue_category" in extracted_info
             enough_messages = message_count >= 4  # At least 2 exchanges
@@ -398,118 +600,143 @@ class ConversationHandler:
             if session_id in self.conversation_states:
                 # Check if state is not too old
                 state = self.conversation_states[session_id]
-                if datetime.now() - state["created_at"] < self.session_timeout:
+                if time.time() - state["created_at_ts"] < self.session_timeout:
+                    self.conversation_states.move_to_end(session_id)
                     return
 
-            conn = await get_db_connection()
-
-            # Load session
-            cursor = await conn.execute("""
-                SELECT user_name, user_email, conversation_state, created_at
-                FROM conversation_sessions 
-                WHERE session_id = ? AND status = 'active'
-            """, (session_id,))
-            session_row = await cursor.fetchone()
-
-            if not session_row:
-                await conn.close()
+            # Load session and messages in one pass; a session with no
+            # messages yields a single row with NULL message columns
+            async with _acquire() as conn:
+                cursor = await conn.execute("""
+                    SELECT s.user_name, s.user_email, s.conversation_state, s.created_at,
+                           m.message_type, m.content, m.timestamp, m.metadata
+                    FROM conversation_sessions s
+                    LEFT JOIN conversation_messages m ON m.session_id = s.session_id
+                    WHERE s.session_id = ? AND s.status = 'active'
+                    ORDER BY m.timestamp ASC, m.id ASC
+                """, (session_id,))
+                rows = await cursor.fetchall()
+
+            if not rows:
                 return
 
-            # Load messages
-            cursor = await conn.execute("""
-                SELECT message_type, content, timestamp, metadata
-                FROM conversation_messages 
-                WHERE session_id = ?
-                ORDER BY timestamp ASC
-            """, (session_id,))
-            message_rows = await cursor.fetchall()
-
-            await conn.close()
+            session_row = rows[0]
 
             # Reconstruct state
             messages = []
             extracted_info = {}
+            message_counts = self._new_message_counts()
+
+            for row in rows:
+                if row[4] is None:
+                    continue
 
-            for row in message_rows:
                 message = {
-                    "type": row[0],
-                    "content": row[1],
-                    "timestamp": datetime.fromisoformat(row[2])
+                    "type": row[4],
+                    "content": row[5],
+                    "timestamp": _to_epoch(row[6])
                 }
-                if row[3]:  # metadata
+                if row[7]:  # metadata
                     try:
-                        metadata = json.loads(row[3])
+                        metadata = orjson.loads(row[7])
                         message["metadata"] = metadata
                         if "extracted_info" in metadata:
                             extracted_info.update(metadata["extracted_info"])
-                    except json.JSONDecodeError:
+                    except orjson.JSONDecodeError:
                         pass
 
                 messages.append(message)
+                self._count_message(message_counts, message)
+
+            if len(messages) > MAX_IN_MEMORY_MESSAGES:
+                messages = messages[-TRIMMED_MESSAGE_COUNT:]
 
-            self.conversation_states[session_id] = {
+            created_at = _to_epoch(session_row[3])
+            self._remember_state(session_id, {
                 "state": session_row[2],
                 "messages": messages,
+                "history_tail": deque(
+                    (self._format_history_line(msg) for msg in messages[-HISTORY_TAIL_SIZE:]),
+                    maxlen=HISTORY_TAIL_SIZE
+                ),
                 "extracted_info": extracted_info,
-                "created_at": datetime.fromisoformat(session_row[3]),
+                "created_at_ts": created_at,
                 "user_info": {
                     "user_name": session_row[0],
                     "user_email": session_row[1]
-                }
-            }
+                },
+                **message_counts
+            })
+            self._track_expiry(session_id, created_at)
 
         except Exception as e:
             logger.error(f"Error loading conversation state: {str(e)}")
 
-    async def store_message(self, session_id: str, message_type: str, content: str, metadata: Dict = None):
-        """Store message in database"""
-        try:
-            conn = await get_db_connection()
-
-            metadata_json = json.dumps(metadata) if metadata else None
+    async def store_message(self, session_id: str, message_type: str, content: str, metadata: Dict = None,
+                            conn=None, timestamp: float = None):
+        """Store message in database; with conn, join the caller's transaction"""
+        metadata_json = orjson.dumps(metadata).decode() if metadata else None
+        params = (session_id, message_type, content, metadata_json,
+                  timestamp if timestamp is not None else time.time())
 
-            await conn.execute("""
-                INSERT INTO conversation_messages 
-                (session_id, message_type, content, metadata)
-                VALUES (?, ?, ?, ?)
-            """, (session_id, message_type, content, metadata_json))
+        if conn is not None:
+            await conn.execute(_INSERT_MESSAGE_SQL, params)
+            return
 
-            await conn.commit()
-            await conn.close()
+        try:
+            async with _acquire() as conn:
+                await conn.execute(_INSERT_MESSAGE_SQL, params)
+                await conn.commit()
 
         except Exception as e:
             logger.error(f"Error storing message: {str(e)}")
 
-    async def update_conversation_state(self, session_id: str, new_state: str):
-        """Update conversation state in database"""
+    async def update_conversation_state(self, session_id: str, new_state: str, conn=None):
+        """Update conversation state in database; with conn, join the caller's transaction"""
+        if conn is not None:
+            await conn.execute(_UPDATE_STATE_SQL, (new_state, session_id))
+            return
+
         try:
-            conn = await get_db_connection()
+            async with _acquire() as conn:
+                await conn.execute(_UPDATE_STATE_SQL, (new_state, session_id))
+                await conn.commit()
 
-            await conn.execute("""
-                UPDATE conversation_sessions 
-                SET conversation_state = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE session_id = ?
-            """, (new_state, session_id))
+        except Exception as e:
+            logger.error(f"Error updating conversation state: {str(e)}")
 
-            await conn.commit()
-            await conn.close()
+    async def store_turn(self, session_id: str, messages: List[Tuple[str, str, Optional[Dict]]],
+                         new_state: str = None, timestamp: float = None):
+        """Store (type, content, metadata) messages and the resulting state with a single commit"""
+        if timestamp is None:
+            timestamp = time.time()
+
+        try:
+            async with _acquire() as conn:
+                await conn.execute("BEGIN")
+                await conn.executemany(_INSERT_MESSAGE_SQL, [
+                    (session_id, message_type, content,
+                     orjson.dumps(metadata).decode() if metadata else None, timestamp)
+                    for message_type, content, metadata in messages
+                ])
+                if new_state is not None:
+                    await self.update_conversation_state(session_id, new_state, conn=conn)
+                await conn.commit()
 
         except Exception as e:
-            logger.error(f"Error updating conversation state: {str(e)}")
+            logger.error(f"Error storing conversation turn: {str(e)}")
 
     async def complete_conversation(self, session_id: str, case_number: str = None):
         """Mark conversation as completed"""
         try:
-            conn = await get_db_connection()
+            async with _acquire() as conn:
+                await conn.execute("""
+                    UPDATE conversation_sessions 
+                    SET status = 'completed', case_number = ?, updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+                    WHERE session_id = ?
+                """, (case_number, session_id))
 
-            await conn.execute("""
-                UPDATE conversation_sessions 
-                SET status = 'completed', case_number = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE session_id = ?
-            """, (case_number, session_id))
-
-            await conn.commit()
-            await conn.close()
+                await conn.commit()
 
             # Clean up memory state
             if session_id in self.conversation_states:
@@ -520,32 +747,35 @@ class ConversationHandler:
         except Exception as e:
             logger.error(f"Error completing conversation: {str(e)}")
 
+    def _track_expiry(self, session_id: str, created_at: float):
+        """Schedule an in-memory session for eviction once it times out"""
+        expires_at = created_at + self.session_timeout
+        heapq.heappush(self._expiry_heap, (expires_at, session_id))
+
     async def cleanup_old_conversations(self):
         """Clean up old conversation sessions"""
         try:
-            cutoff_time = datetime.now() - timedelta(days=7)  # 7 days old
-
-            conn = await get_db_connection()
-
-            await conn.execute("""
-                UPDATE conversation_sessions 
-                SET status = 'archived'
-                WHERE created_at < ? AND status = 'active'
-            """, (cutoff_time.isoformat(),))
-
-            await conn.commit()
-            await conn.close()
-
-            # Clean up memory states
-            expired_sessions = [
-                session_id for session_id, state in self.conversation_states.items()
-                if datetime.now() - state["created_at"] > self.session_timeout
-            ]
-
-            for session_id in expired_sessions:
-                del self.conversation_states[session_id]
-
-            logger.info(f"Cleaned up {len(expired_sessions)} expired conversation sessions")
+            cutoff_time = int(time.time()) - ARCHIVE_AFTER_SECONDS
+
+            async with _acquire() as conn:
+                await conn.execute("""
+                    UPDATE conversation_sessions 
+                    SET status = 'archived'
+                    WHERE created_at < ? AND status = 'active'
+                """, (cutoff_time,))
+
+                await conn.commit()
+
+            # Clean up memory states, popping only the heap entries that have expired
+            now = time.time()
+            expired_count = 0
+            while self._expiry_heap and self._expiry_heap[0][0] < now:
+                _, session_id = heapq.heappop(self._expiry_heap)
+                # Entries for completed or reloaded sessions may already be gone
+                if self.conversation_states.pop(session_id, None) is not None:
+                    expired_count += 1
+
+            logger.info(f"Cleaned up {expired_count} expired conversation sessions")
 
         except Exception as e:
             logger.error(f"Error cleaning up conversations: {str(e)}")
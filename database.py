@@ -9,93 +9,484 @@ import sqlite3
 import aiosqlite
 import asyncio
 import logging
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
 import os
 from pathlib import Path
-import json
+import orjson
+import time
+import numpy as np
+import zstandard
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 
 logger = logging.getLogger(__name__)
 
 DATABASE_PATH = "metadata.db"
 
-async def init_db():
-    """Initialize the SQLite database and create tables"""
+# Per-connection settings; journal_mode=WAL is persistent and set when the writer opens
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",  # 64 MB page cache
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",  # Needed for ON DELETE CASCADE on document_chunks
+    "PRAGMA mmap_size=268435456",  # 256 MB
+)
+
+# Stored in PRAGMA user_version; bump whenever _create_schema changes
+SCHEMA_VERSION = 1
+
+# Prepared statements kept per connection (sqlite3 defaults to 128)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+
+async def _apply_pragmas(db: aiosqlite.Connection):
+    """Apply the standard connection PRAGMAs"""
+    for pragma in CONNECTION_PRAGMAS:
+        await db.execute(pragma)
+
+# Single long-lived writer connection; aiosqlite runs it on its own worker thread
+_DB: Optional[aiosqlite.Connection] = None
+_db_open_lock = asyncio.Lock()
+# Serializes write transactions on the shared connection
+_write_lock = asyncio.Lock()
+
+# Read-only connections for SELECTs; with WAL they run alongside the writer
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+_readers: Optional[asyncio.Queue] = None
+_readers_lock = asyncio.Lock()
+
+# Write-behind query log: rows are queued and flushed in batches
+QUERY_LOG_QUEUE_SIZE = int(os.getenv("QUERY_LOG_QUEUE_SIZE", "10000"))
+QUERY_LOG_BATCH_SIZE = int(os.getenv("QUERY_LOG_BATCH_SIZE", "256"))
+QUERY_LOG_FLUSH_SECONDS = float(os.getenv("QUERY_LOG_FLUSH_SECONDS", "0.25"))
+_query_log_q: asyncio.Queue = asyncio.Queue(maxsize=QUERY_LOG_QUEUE_SIZE)
+_query_log_task: Optional[asyncio.Task] = None
+
+DB_OPTIMIZE_INTERVAL_SECONDS = int(os.getenv("DB_OPTIMIZE_INTERVAL_SECONDS", "3600"))
+_optimize_task: Optional[asyncio.Task] = None
+
+async def _conn() -> aiosqlite.Connection:
+    """Return the shared connection, opening it on first use"""
+    global _DB
+    if _DB is None:
+        async with _db_open_lock:
+            if _DB is None:
+                # isolation_level=None: no implicit BEGINs, _writer issues BEGIN IMMEDIATE
+                db = await aiosqlite.connect(DATABASE_PATH, isolation_level=None,
+                                             cached_statements=DB_STATEMENT_CACHE_SIZE)
+                # WAL lets readers proceed during writes and needs one fsync per commit
+                await db.execute("PRAGMA journal_mode=WAL")
+                await _apply_pragmas(db)
+                db.row_factory = aiosqlite.Row
+                _DB = db
+    return _DB
+
+async def _init_readers():
+    """Open the read-only connection pool once"""
+    global _readers
+    async with _readers_lock:
+        if _readers is not None:
+            return
+
+        # The writer creates the database file and its WAL before read-only opens
+        await _conn()
+        uri = f"{Path(DATABASE_PATH).resolve().as_uri()}?mode=ro"
+        readers = asyncio.Queue(maxsize=DB_READ_POOL_SIZE)
+        for _ in range(DB_READ_POOL_SIZE):
+            db = await aiosqlite.connect(uri, uri=True, isolation_level=None,
+                                         cached_statements=DB_STATEMENT_CACHE_SIZE)
+            await _apply_pragmas(db)
+            db.row_factory = aiosqlite.Row
+            readers.put_nowait(db)
+        _readers = readers
+        logger.info(f"Database read pool opened with {DB_READ_POOL_SIZE} connections")
+
+@asynccontextmanager
+async def _reader():
+    """Borrow a read-only connection from the pool"""
+    if _readers is None:
+        await _init_readers()
+
+    db = await _readers.get()
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            # Create documents table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS documents (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    filename TEXT NOT NULL,
-                    original_filename TEXT NOT NULL,
-                    team TEXT NOT NULL,
-                    project TEXT NOT NULL,
-                    file_type TEXT NOT NULL,
-                    file_size INTEGER NOT NULL,
-                    file_path TEXT NOT NULL,
-                    upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    processed_date TIMESTAMP,
-                    chunk_count INTEGER DEFAULT 0,
-                    status TEXT DEFAULT 'pending',
-                    uploaded_by TEXT,
-                    description TEXT,
-                    metadata TEXT
-                )
-            """)
-
-            # Create document chunks table for embeddings
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS document_chunks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    document_id INTEGER NOT NULL,
-                    chunk_index INTEGER NOT NULL,
-                    chunk_text TEXT NOT NULL,
-                    chunk_size INTEGER NOT NULL,
-                    embedding_vector TEXT,
-                    page_number INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (document_id) REFERENCES documents (id) ON DELETE CASCADE
-                )
-            """)
-
-            # Create queries table for logging user questions
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_queries (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    question TEXT NOT NULL,
-                    answer TEXT,
-                    confidence REAL,
-                    response_time_ms INTEGER,
-                    team_context TEXT,
-                    project_context TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    user_session TEXT,
-                    sources_used TEXT
-                )
-            """)
+        yield db
+    finally:
+        _readers.put_nowait(db)
+
+@asynccontextmanager
+async def _writer():
+    """Run a write transaction on the writer connection
+
+    BEGIN IMMEDIATE takes the write lock up front, so the transaction never
+    has to upgrade from a read lock and hit SQLITE_BUSY under WAL.
+    """
+    db = await _conn()
+    async with _write_lock:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            await db.execute("ROLLBACK")
+            raise
+        await db.execute("COMMIT")
+
+# Document columns returned by default; the large metadata column is opt-in
+DOCUMENT_COLUMNS = (
+    "id", "filename", "original_filename", "team", "project", "file_type",
+    "file_size", "file_path", "upload_date", "processed_date", "chunk_count",
+    "status", "uploaded_by", "description"
+)
+_DOCUMENT_ALL_COLUMNS = frozenset(DOCUMENT_COLUMNS + ("metadata",))
+_SELECT_DOCUMENT_BY_ID_SQL = f"SELECT {', '.join(DOCUMENT_COLUMNS)} FROM documents WHERE id = ?"
+
+# Statement text is built once so the per-connection statement cache, keyed on
+# the SQL string, keeps hitting; formatting SQL at call sites would miss it
+_INSERT_DOCUMENT_SQL = """
+    INSERT INTO documents (
+        filename, original_filename, team, project, file_type,
+        file_size, file_path, uploaded_by, status
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending')
+"""
+# RETURNING needs SQLite 3.35+; older libraries fall back to lastrowid
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+_INSERT_DOCUMENT_RETURNING_SQL = _INSERT_DOCUMENT_SQL.rstrip() + " RETURNING id\n"
+_INSERT_CHUNK_SQL = """
+    INSERT INTO document_chunks (
+        document_id, chunk_index, chunk_text, chunk_size,
+        embedding_vector, page_number
+    ) VALUES (?, ?, ?, ?, ?, ?)
+"""
+_UPDATE_STATUS_SQL = "UPDATE documents SET status = ? WHERE id = ?"
+_UPDATE_STATUS_WITH_COUNT_SQL = """
+    UPDATE documents
+    SET status = ?, chunk_count = ?, processed_date = CURRENT_TIMESTAMP
+    WHERE id = ?
+"""
+_INSERT_USER_QUERY_SQL = """
+    INSERT INTO user_queries (
+        question, answer, confidence, response_time_ms,
+        team_context, project_context, sources_used, user_session, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_DELETE_DOCUMENT_SQL = "DELETE FROM documents WHERE id = ?"
+_POP_DOCUMENT_SQL = "DELETE FROM documents WHERE id = ? RETURNING filename, team, project, file_path"
+_SELECT_DOCUMENT_FILE_SQL = "SELECT filename, team, project, file_path FROM documents WHERE id = ?"
+# Anti-join probing the documents primary key per chunk. With foreign_keys=ON
+# deletes cascade, so only rows left over from before that can be orphaned.
+_DELETE_ORPHANED_CHUNKS_SQL = """
+    DELETE FROM document_chunks
+    WHERE NOT EXISTS (
+        SELECT 1 FROM documents d WHERE d.id = document_chunks.document_id
+    )
+"""
+_TOTALS_SQL = """
+    SELECT (SELECT COUNT(*) FROM documents),
+           (SELECT COUNT(*) FROM document_chunks),
+           (SELECT COALESCE(SUM(count), 0) FROM user_queries_daily)
+"""
+_STATUS_BREAKDOWN_SQL = "SELECT status, COUNT(*) FROM documents GROUP BY status"
+_TEAM_BREAKDOWN_SQL = "SELECT team, COUNT(*) FROM documents GROUP BY team"
+_RECENT_QUERIES_SQL = """
+    SELECT question, confidence, response_time_ms, created_at
+    FROM user_queries
+    ORDER BY created_at DESC
+    LIMIT ? OFFSET ?
+"""
+_RECENT_QUERIES_SINCE_SQL = """
+    SELECT question, confidence, response_time_ms, created_at
+    FROM user_queries
+    WHERE created_at >= ?
+    ORDER BY created_at DESC
+    LIMIT ? OFFSET ?
+"""
+# FAISS index bookkeeping (embeddings.py)
+_CHUNK_METADATA_SQL = """
+    SELECT dc.id, dc.document_id, dc.chunk_index, dc.page_number,
+           d.filename, d.team, d.project
+    FROM document_chunks dc
+    JOIN documents d ON dc.document_id = d.id
+    WHERE d.status = 'completed'
+    ORDER BY dc.document_id, dc.chunk_index
+"""
+_COMPLETED_CHUNK_IDS_SQL = """
+    SELECT dc.id FROM document_chunks dc
+    JOIN documents d ON dc.document_id = d.id
+    WHERE d.status = 'completed'
+"""
+_COMPLETED_DOCUMENTS_SQL = "SELECT id, filename, team, project FROM documents WHERE status = 'completed'"
+_REINDEX_CHUNKS_SQL = """
+    SELECT chunk_text, chunk_index, id, embedding_vector FROM document_chunks
+    WHERE document_id = ?
+    ORDER BY chunk_index
+"""
+_UPDATE_CHUNK_EMBEDDING_SQL = "UPDATE document_chunks SET embedding_vector = ? WHERE id = ?"
+_CHUNKS_AFTER_SQL = """
+    SELECT dc.id, dc.document_id, dc.chunk_index, dc.page_number,
+           d.filename, d.team, d.project, dc.embedding_vector
+    FROM document_chunks dc
+    JOIN documents d ON dc.document_id = d.id
+    WHERE d.status = 'completed' AND dc.id > ? AND dc.embedding_vector IS NOT NULL
+    ORDER BY dc.id
+"""
 
-            # Create indexes for better query performance
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_documents_team_project 
-                ON documents(team, project)
-            """)
+# get_document_by_id cache: document_id -> (row dict, monotonic expiry)
+DOCUMENT_CACHE_MAX_ENTRIES = int(os.getenv("DOCUMENT_CACHE_MAX_ENTRIES", "1024"))
+DOCUMENT_CACHE_TTL_SECONDS = float(os.getenv("DOCUMENT_CACHE_TTL_SECONDS", "60"))
+_document_cache: "OrderedDict[int, Tuple[Dict, float]]" = OrderedDict()
+# get_documents_by_team_project cache: (team, project, columns) -> (rows, monotonic expiry)
+DOCUMENT_LIST_CACHE_TTL_SECONDS = float(os.getenv("DOCUMENT_LIST_CACHE_TTL_SECONDS", "5"))
+DOCUMENT_LIST_CACHE_MAX_ENTRIES = int(os.getenv("DOCUMENT_LIST_CACHE_MAX_ENTRIES", "256"))
+_document_list_cache: "OrderedDict[Tuple, Tuple[List[Dict], float]]" = OrderedDict()
+# Bumped on every invalidation so an in-flight read can't cache a stale row
+_document_cache_generation = 0
+
+def _invalidate_document_lists():
+    """Drop every cached get_documents_by_team_project result"""
+    global _document_cache_generation
+    _document_cache_generation += 1
+    _document_list_cache.clear()
+
+def _invalidate_document(document_id: int):
+    """Drop a document from the get_document_by_id and document list caches"""
+    _invalidate_document_lists()
+    _document_cache.pop(document_id, None)
+
+_CREATE_DOCUMENT_CHUNKS_SQL = """
+    CREATE TABLE IF NOT EXISTS document_chunks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id INTEGER NOT NULL,
+        chunk_index INTEGER NOT NULL,
+        chunk_text BLOB NOT NULL,
+        chunk_size INTEGER NOT NULL,
+        embedding_vector BLOB,
+        page_number INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (document_id) REFERENCES documents (id) ON DELETE CASCADE
+    )
+"""
 
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_document_chunks_document_id 
-                ON document_chunks(document_id)
-            """)
+# chunk_text is stored zstd-compressed; shorter values stay plain text
+CHUNK_COMPRESS_MIN_CHARS = int(os.getenv("CHUNK_COMPRESS_MIN_CHARS", "256"))
+CHUNK_COMPRESS_LEVEL = int(os.getenv("CHUNK_COMPRESS_LEVEL", "3"))
+_zstd_compressor = zstandard.ZstdCompressor(level=CHUNK_COMPRESS_LEVEL)
+_zstd_decompressor = zstandard.ZstdDecompressor()
+
+def compress_chunk_text(text: str):
+    """Encode chunk text for storage, compressing values worth the CPU"""
+    if len(text) < CHUNK_COMPRESS_MIN_CHARS:
+        return text
+    return _zstd_compressor.compress(text.encode("utf-8"))
+
+def decompress_chunk_text(value) -> str:
+    """Decode a stored chunk_text value; plain TEXT rows pass through"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return _zstd_decompressor.decompress(bytes(value)).decode("utf-8")
+    return value
+
+def embedding_to_blob(embedding) -> Optional[bytes]:
+    """Pack an embedding as raw float32 bytes for the embedding_vector column"""
+    if embedding is None:
+        return None
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+def blob_to_embedding(blob: Optional[bytes]) -> Optional[np.ndarray]:
+    """Unpack an embedding_vector BLOB into a float32 array"""
+    if blob is None:
+        return None
+    return np.frombuffer(blob, dtype=np.float32)
+
+async def _migrate_embedding_column(db: aiosqlite.Connection):
+    """Convert a legacy JSON TEXT embedding_vector column to float32 BLOBs"""
+    cursor = await db.execute("PRAGMA table_info(document_chunks)")
+    column_types = {row[1]: (row[2] or "").upper() for row in await cursor.fetchall()}
+    if column_types.get("embedding_vector") != "TEXT":
+        return
+
+    logger.info("Migrating document_chunks.embedding_vector from JSON TEXT to BLOB")
+    await db.execute("ALTER TABLE document_chunks RENAME TO document_chunks_old")
+    await db.execute(_CREATE_DOCUMENT_CHUNKS_SQL)
+
+    cursor = await db.execute("""
+        SELECT id, document_id, chunk_index, chunk_text, chunk_size,
+               embedding_vector, page_number, created_at
+        FROM document_chunks_old
+    """)
+    rows = [
+        (*row[:5], embedding_to_blob(orjson.loads(row[5])) if row[5] else None, *row[6:])
+        for row in await cursor.fetchall()
+    ]
+    await db.executemany("""
+        INSERT INTO document_chunks (
+            id, document_id, chunk_index, chunk_text, chunk_size,
+            embedding_vector, page_number, created_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+
+    # Dropping the old table also drops its indexes so init_db recreates them
+    await db.execute("DROP TABLE document_chunks_old")
+    logger.info(f"Migrated {len(rows)} chunk embeddings to BLOB")
+
+async def optimize_db():
+    """Let SQLite refresh planner statistics where they have gone stale"""
+    try:
+        db = await _conn()
+        async with _write_lock:
+            await db.execute("PRAGMA optimize")
+    except Exception as e:
+        logger.error(f"Error optimizing database: {str(e)}")
+
+async def _optimize_periodically():
+    """Run PRAGMA optimize every DB_OPTIMIZE_INTERVAL_SECONDS"""
+    while True:
+        await asyncio.sleep(DB_OPTIMIZE_INTERVAL_SECONDS)
+        await optimize_db()
+
+async def close_db():
+    """Flush the query log, then close the shared connection and the read pool"""
+    global _DB, _readers, _optimize_task, _query_log_task
+    if _query_log_task is not None:
+        # None tells the drain loop to flush what it has and stop
+        await _query_log_q.put(None)
+        await _query_log_task
+        _query_log_task = None
+    if _optimize_task is not None:
+        _optimize_task.cancel()
+        _optimize_task = None
+    if _readers is not None:
+        while not _readers.empty():
+            await _readers.get_nowait().close()
+        _readers = None
+    if _DB is not None:
+        await optimize_db()
+        await _DB.close()
+        _DB = None
+        logger.info("Database connection closed")
+
+async def _create_schema(db: aiosqlite.Connection):
+    """Create tables, indexes and triggers, migrating older layouts"""
+    # Create documents table
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            original_filename TEXT NOT NULL,
+            team TEXT NOT NULL,
+            project TEXT NOT NULL,
+            file_type TEXT NOT NULL,
+            file_size INTEGER NOT NULL,
+            file_path TEXT NOT NULL,
+            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_date TIMESTAMP,
+            chunk_count INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'pending',
+            uploaded_by TEXT,
+            description TEXT,
+            metadata TEXT
+        )
+    """)
+
+    # Create document chunks table for embeddings
+    await db.execute(_CREATE_DOCUMENT_CHUNKS_SQL)
+    await _migrate_embedding_column(db)
+
+    # Create queries table for logging user questions
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_queries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT NOT NULL,
+            answer TEXT,
+            confidence REAL,
+            response_time_ms INTEGER,
+            team_context TEXT,
+            project_context TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            user_session TEXT,
+            sources_used TEXT
+        )
+    """)
+
+    # Daily query rollup kept current by a trigger, so stats never scan user_queries
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_queries_daily (
+            day TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0,
+            sum_confidence REAL NOT NULL DEFAULT 0,
+            sum_rt_ms INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor = await db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_uq_rollup'"
+    )
+    if await cursor.fetchone() is None:
+        # First run with the rollup: backfill from existing rows in the same transaction
+        await db.execute("""
+            INSERT OR REPLACE INTO user_queries_daily (day, count, sum_confidence, sum_rt_ms)
+            SELECT date(created_at), COUNT(*),
+                   SUM(COALESCE(confidence, 0)), SUM(COALESCE(response_time_ms, 0))
+            FROM user_queries
+            GROUP BY date(created_at)
+        """)
+        await db.execute("""
+            CREATE TRIGGER trg_uq_rollup AFTER INSERT ON user_queries
+            BEGIN
+                INSERT INTO user_queries_daily (day, count, sum_confidence, sum_rt_ms)
+                VALUES (date(NEW.created_at), 1,
+                        COALESCE(NEW.confidence, 0), COALESCE(NEW.response_time_ms, 0))
+                ON CONFLICT(day) DO UPDATE SET
+                    count = count + 1,
+                    sum_confidence = sum_confidence + excluded.sum_confidence,
+                    sum_rt_ms = sum_rt_ms + excluded.sum_rt_ms;
+            END
+        """)
+
+    # Create indexes for better query performance
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_documents_team_project 
+        ON documents(team, project)
+    """)
+
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_document_chunks_document_id 
+        ON document_chunks(document_id)
+    """)
+
+    # Indexes for the stats breakdowns and recent-query listing
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_documents_status ON documents(status)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_documents_team ON documents(team)")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_queries_created_at
+        ON user_queries(created_at DESC)
+    """)
 
-            await db.commit()
-            logger.info("Database initialized successfully")
+async def init_db():
+    """Initialize the SQLite database and create tables"""
+    try:
+        async with _writer() as db:
+            # Skip the DDL entirely when the file already has the current schema
+            cursor = await db.execute("PRAGMA user_version")
+            (version,) = await cursor.fetchone()
+            if version != SCHEMA_VERSION:
+                await _create_schema(db)
+                await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                logger.info(f"Database schema upgraded from version {version} to {SCHEMA_VERSION}")
+
+        logger.info("Database initialized successfully")
+
+        global _optimize_task
+        if _optimize_task is None:
+            _optimize_task = asyncio.create_task(_optimize_periodically())
+        _start_query_log()
 
     except Exception as e:
         logger.error(f"Database initialization error: {str(e)}")
         raise
 
 async def get_db_connection():
-    """Get database connection"""
-    return await aiosqlite.connect(DATABASE_PATH)
+    """Get database connection; the caller is responsible for closing it"""
+    db = await aiosqlite.connect(DATABASE_PATH)
+    await _apply_pragmas(db)
+    return db
 
 async def insert_document(
     filename: str,
@@ -109,20 +500,19 @@ async def insert_document(
 ) -> int:
     """Insert document record and return document ID"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            cursor = await db.execute("""
-                INSERT INTO documents (
-                    filename, original_filename, team, project, file_type,
-                    file_size, file_path, uploaded_by, status
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending')
-            """, (filename, original_filename, team, project, file_type, 
-                  file_size, file_path, uploaded_by))
-
-            document_id = cursor.lastrowid
-            await db.commit()
+        async with _writer() as db:
+            params = (filename, original_filename, team, project, file_type,
+                      file_size, file_path, uploaded_by)
+            if _HAS_RETURNING:
+                cursor = await db.execute(_INSERT_DOCUMENT_RETURNING_SQL, params)
+                document_id = (await cursor.fetchone())[0]
+            else:
+                cursor = await db.execute(_INSERT_DOCUMENT_SQL, params)
+                document_id = cursor.lastrowid
 
-            logger.info(f"Document inserted with ID: {document_id}")
-            return document_id
+        _invalidate_document_lists()
+        logger.info(f"Document inserted with ID: {document_id}")
+        return document_id
 
     except Exception as e:
         logger.error(f"Error inserting document: {str(e)}")
@@ -132,28 +522,42 @@ async def insert_document_chunk(
     document_id: int,
     chunk_index: int,
     chunk_text: str,
-    embedding_vector: str = None,
+    embedding_vector: Optional[bytes] = None,
     page_number: int = None
 ) -> int:
     """Insert document chunk and return chunk ID"""
-    try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            cursor = await db.execute("""
-                INSERT INTO document_chunks (
-                    document_id, chunk_index, chunk_text, chunk_size,
-                    embedding_vector, page_number
-                ) VALUES (?, ?, ?, ?, ?, ?)
-            """, (document_id, chunk_index, chunk_text, len(chunk_text),
-                  embedding_vector, page_number))
+    chunk_ids = await insert_document_chunks(
+        document_id, [(chunk_index, chunk_text, embedding_vector, page_number)]
+    )
+    return chunk_ids[0]
 
-            chunk_id = cursor.lastrowid
-            await db.commit()
+async def insert_document_chunks(
+    document_id: int,
+    chunks: List[Tuple[int, str, Optional[bytes], Optional[int]]]
+) -> List[int]:
+    """Insert (chunk_index, chunk_text, embedding_vector, page_number) rows in one transaction and return their IDs"""
+    if not chunks:
+        return []
 
-            logger.info(f"Document chunk inserted with ID: {chunk_id}")
-            return chunk_id
+    try:
+        async with _writer() as db:
+            # chunk_size keeps the uncompressed character count
+            await db.executemany(_INSERT_CHUNK_SQL, [
+                (document_id, chunk_index, compress_chunk_text(chunk_text), len(chunk_text),
+                 embedding_vector, page_number)
+                for chunk_index, chunk_text, embedding_vector, page_number in chunks
+            ])
+
+            # Rows from one transaction under the write lock get consecutive IDs
+            cursor = await db.execute("SELECT last_insert_rowid()")
+            last_id = (await cursor.fetchone())[0]
+
+        chunk_ids = list(range(last_id - len(chunks) + 1, last_id + 1))
+        logger.info(f"Inserted {len(chunk_ids)} chunks for document ID: {document_id}")
+        return chunk_ids
 
     except Exception as e:
-        logger.error(f"Error inserting document chunk: {str(e)}")
+        logger.error(f"Error inserting document chunks: {str(e)}")
         raise
 
 async def update_document_status(
@@ -163,27 +567,62 @@ async def update_document_status(
 ):
     """Update document processing status"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _writer() as db:
             if chunk_count is not None:
-                await db.execute("""
-                    UPDATE documents 
-                    SET status = ?, chunk_count = ?, processed_date = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                """, (status, chunk_count, document_id))
+                await db.execute(_UPDATE_STATUS_WITH_COUNT_SQL, (status, chunk_count, document_id))
             else:
-                await db.execute("""
-                    UPDATE documents 
-                    SET status = ?
-                    WHERE id = ?
-                """, (status, document_id))
+                await db.execute(_UPDATE_STATUS_SQL, (status, document_id))
 
-            await db.commit()
-            logger.info(f"Document {document_id} status updated to: {status}")
+        _invalidate_document(document_id)
+        logger.info(f"Document {document_id} status updated to: {status}")
 
     except Exception as e:
         logger.error(f"Error updating document status: {str(e)}")
         raise
 
+def _start_query_log():
+    """Start the background query log writer if it isn't running"""
+    global _query_log_task
+    if _query_log_task is None:
+        _query_log_task = asyncio.create_task(_drain_query_log())
+
+async def _flush_query_log(batch: List[Tuple]):
+    """Write a batch of queued query log rows in one transaction"""
+    try:
+        async with _writer() as db:
+            await db.executemany(_INSERT_USER_QUERY_SQL, batch)
+        logger.debug(f"Logged {len(batch)} user queries")
+    except Exception as e:
+        logger.error(f"Error logging user queries: {str(e)}")
+
+async def _drain_query_log():
+    """Flush queued query log rows every QUERY_LOG_BATCH_SIZE rows or QUERY_LOG_FLUSH_SECONDS"""
+    loop = asyncio.get_running_loop()
+    while True:
+        row = await _query_log_q.get()
+        if row is None:
+            return
+
+        batch = [row]
+        stopping = False
+        deadline = loop.time() + QUERY_LOG_FLUSH_SECONDS
+        while len(batch) < QUERY_LOG_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                row = await asyncio.wait_for(_query_log_q.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if row is None:
+                stopping = True
+                break
+            batch.append(row)
+
+        await _flush_query_log(batch)
+        if stopping:
+            return
+
 async def log_user_query(
     question: str,
     answer: str = None,
@@ -194,158 +633,244 @@ async def log_user_query(
     sources_used: List[int] = None,
     user_session: str = None
 ):
-    """Log user query for analytics"""
+    """Queue user query for analytics; rows are written in the background"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            sources_json = json.dumps(sources_used) if sources_used else None
-            
-            await db.execute("""
-                INSERT INTO user_queries (
-                    question, answer, confidence, response_time_ms,
-                    team_context, project_context, sources_used, user_session
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (question, answer, confidence, response_time_ms,
-                  team_context, project_context, sources_json, user_session))
+        sources_json = orjson.dumps(sources_used).decode() if sources_used else None
+        # Stamp now in CURRENT_TIMESTAMP's format rather than at flush time
+        created_at = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
-            await db.commit()
-            logger.info("User query logged successfully")
+        _start_query_log()
+        _query_log_q.put_nowait((question, answer, confidence, response_time_ms,
+                                 team_context, project_context, sources_json, user_session, created_at))
 
+    except asyncio.QueueFull:
+        logger.debug("Query log queue full, dropping user query")
     except Exception as e:
         logger.error(f"Error logging user query: {str(e)}")
 
-async def get_documents_by_team_project(team: str = None, project: str = None) -> List[Dict]:
-    """Get documents filtered by team and/or project"""
+def _documents_query(team: Optional[str], project: Optional[str],
+                     columns: Tuple[str, ...]) -> Tuple[str, List[str]]:
+    """Build the filtered documents SELECT and its parameters"""
+    unknown = set(columns) - _DOCUMENT_ALL_COLUMNS
+    if unknown:
+        raise ValueError(f"Unknown document columns: {sorted(unknown)}")
+
+    query = f"SELECT {', '.join(columns)} FROM documents"
+    params = []
+
+    if team or project:
+        conditions = []
+        if team:
+            conditions.append("team = ?")
+            params.append(team)
+        if project:
+            conditions.append("project = ?")
+            params.append(project)
+        query += " WHERE " + " AND ".join(conditions)
+
+    query += " ORDER BY upload_date DESC, id DESC"
+    return query, params
+
+async def get_documents_by_team_project(
+    team: str = None,
+    project: str = None,
+    columns: Tuple[str, ...] = DOCUMENT_COLUMNS,
+    batch: int = 500
+) -> List[Dict]:
+    """Get documents filtered by team and/or project, selecting only the given columns"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            query = "SELECT * FROM documents"
-            params = []
-
-            if team or project:
-                conditions = []
-                if team:
-                    conditions.append("team = ?")
-                    params.append(team)
-                if project:
-                    conditions.append("project = ?")
-                    params.append(project)
-                query += " WHERE " + " AND ".join(conditions)
-
-            query += " ORDER BY upload_date DESC"
-
+        key = (team, project, tuple(columns))
+        entry = _document_list_cache.get(key)
+        if entry is not None:
+            documents, expires_at = entry
+            if expires_at > time.monotonic():
+                _document_list_cache.move_to_end(key)
+                return [dict(document) for document in documents]
+            del _document_list_cache[key]
+
+        generation = _document_cache_generation
+        query, params = _documents_query(team, project, columns)
+        async with _reader() as db:
             cursor = await db.execute(query, params)
-            rows = await cursor.fetchall()
-
-            documents = []
-            for row in rows:
-                documents.append({
-                    "id": row[0],
-                    "filename": row[1],
-                    "original_filename": row[2],
-                    "team": row[3],
-                    "project": row[4],
-                    "file_type": row[5],
-                    "file_size": row[6],
-                    "file_path": row[7],
-                    "upload_date": row[8],
-                    "processed_date": row[9],
-                    "chunk_count": row[10],
-                    "status": row[11],
-                    "uploaded_by": row[12],
-                    "description": row[13],
-                    "metadata": row[14]
-                })
-
-            return documents
+            cursor.arraysize = batch
+            documents = [dict(row) async for row in cursor]
+
+        if generation == _document_cache_generation:
+            _document_list_cache[key] = (documents, time.monotonic() + DOCUMENT_LIST_CACHE_TTL_SECONDS)
+            while len(_document_list_cache) > DOCUMENT_LIST_CACHE_MAX_ENTRIES:
+                _document_list_cache.popitem(last=False)
+        return [dict(document) for document in documents]
 
     except Exception as e:
         logger.error(f"Error getting documents: {str(e)}")
         return []
 
+async def iter_documents_by_team_project(
+    team: str = None,
+    project: str = None,
+    columns: Tuple[str, ...] = DOCUMENT_COLUMNS,
+    batch: int = 500
+) -> AsyncIterator[Dict]:
+    """Stream documents filtered by team and/or project, batch rows per query
+
+    The pooled reader is returned between batches, so an iterator abandoned part way
+    holds no connection. Documents added or deleted meanwhile can shift the pages.
+    """
+    query, params = _documents_query(team, project, columns)
+    query += " LIMIT ? OFFSET ?"
+    offset = 0
+    while True:
+        async with _reader() as db:
+            rows = await db.execute_fetchall(query, (*params, batch, offset))
+        for row in rows:
+            yield dict(row)
+        if len(rows) < batch:
+            return
+        offset += batch
+
 async def get_document_by_id(document_id: int) -> Optional[Dict]:
     """Get document by ID"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            cursor = await db.execute("SELECT * FROM documents WHERE id = ?", (document_id,))
+        entry = _document_cache.get(document_id)
+        if entry is not None:
+            document, expires_at = entry
+            if expires_at > time.monotonic():
+                _document_cache.move_to_end(document_id)
+                return dict(document)
+            del _document_cache[document_id]
+
+        generation = _document_cache_generation
+        async with _reader() as db:
+            cursor = await db.execute(_SELECT_DOCUMENT_BY_ID_SQL, (document_id,))
             row = await cursor.fetchone()
 
-            if row:
-                return {
-                    "id": row[0],
-                    "filename": row[1],
-                    "original_filename": row[2],
-                    "team": row[3],
-                    "project": row[4],
-                    "file_type": row[5],
-                    "file_size": row[6],
-                    "file_path": row[7],
-                    "upload_date": row[8],
-                    "processed_date": row[9],
-                    "chunk_count": row[10],
-                    "status": row[11],
-                    "uploaded_by": row[12],
-                    "description": row[13],
-                    "metadata": row[14]
-                }
+        if row is None:
             return None
 
+        document = dict(row)
+        if generation == _document_cache_generation:
+            _document_cache[document_id] = (document, time.monotonic() + DOCUMENT_CACHE_TTL_SECONDS)
+            while len(_document_cache) > DOCUMENT_CACHE_MAX_ENTRIES:
+                _document_cache.popitem(last=False)
+        return dict(document)
+
     except Exception as e:
         logger.error(f"Error getting document by ID: {str(e)}")
         return None
 
+async def get_chunks_by_ids(chunk_ids: List[int]) -> Dict[int, Tuple[str, Optional[int]]]:
+    """Fetch (chunk_text, page_number) for many chunks in one query, keyed by chunk ID"""
+    if not chunk_ids:
+        return {}
+    try:
+        placeholders = ",".join("?" * len(chunk_ids))
+        async with _reader() as db:
+            rows = await db.execute_fetchall(
+                f"SELECT id, chunk_text, page_number FROM document_chunks WHERE id IN ({placeholders})",
+                tuple(chunk_ids)
+            )
+        return {row[0]: (decompress_chunk_text(row[1]), row[2]) for row in rows}
+
+    except Exception as e:
+        logger.error(f"Error getting chunks: {str(e)}")
+        return {}
+
+async def get_chunk_embeddings(chunk_ids: List[int]) -> Dict[int, np.ndarray]:
+    """Fetch stored float32 embeddings for many chunks in one query, keyed by chunk ID"""
+    if not chunk_ids:
+        return {}
+    placeholders = ",".join("?" * len(chunk_ids))
+    async with _reader() as db:
+        rows = await db.execute_fetchall(
+            f"SELECT id, embedding_vector FROM document_chunks WHERE id IN ({placeholders}) AND embedding_vector IS NOT NULL",
+            tuple(chunk_ids)
+        )
+    return {row[0]: blob_to_embedding(row[1]) for row in rows}
+
+async def get_chunk_metadata() -> List[Tuple]:
+    """Metadata rows for every chunk of a completed document, in FAISS index order"""
+    async with _reader() as db:
+        return await db.execute_fetchall(_CHUNK_METADATA_SQL)
+
+async def get_completed_chunk_ids() -> set:
+    """IDs of all chunks belonging to completed documents"""
+    async with _reader() as db:
+        return {row[0] for row in await db.execute_fetchall(_COMPLETED_CHUNK_IDS_SQL)}
+
+async def get_completed_documents() -> List[Tuple]:
+    """(id, filename, team, project) of every completed document"""
+    async with _reader() as db:
+        return await db.execute_fetchall(_COMPLETED_DOCUMENTS_SQL)
+
+async def get_chunks_for_reindex(document_id: int) -> List[Tuple]:
+    """(chunk_text, chunk_index, id, embedding_vector) of a document's chunks in order"""
+    async with _reader() as db:
+        return await db.execute_fetchall(_REINDEX_CHUNKS_SQL, (document_id,))
+
+async def get_chunks_after(chunk_id: int) -> List[Tuple]:
+    """Metadata rows plus embedding_vector for completed chunks with an ID above chunk_id"""
+    async with _reader() as db:
+        return await db.execute_fetchall(_CHUNKS_AFTER_SQL, (chunk_id,))
+
+async def update_chunk_embeddings(rows: List[Tuple[bytes, int]]):
+    """Store regenerated (embedding_vector, chunk id) pairs in one transaction"""
+    async with _writer() as db:
+        await db.executemany(_UPDATE_CHUNK_EMBEDDING_SQL, rows)
+
+async def pop_document(document_id: int) -> Optional[Dict]:
+    """Delete a document and its chunks in one transaction; its filename, team, project and file_path, or None"""
+    async with _writer() as db:
+        # Chunks go with it via ON DELETE CASCADE (foreign_keys=ON on every connection)
+        if _HAS_RETURNING:
+            rows = await db.execute_fetchall(_POP_DOCUMENT_SQL, (document_id,))
+        else:
+            rows = await db.execute_fetchall(_SELECT_DOCUMENT_FILE_SQL, (document_id,))
+            if rows:
+                await db.execute(_DELETE_DOCUMENT_SQL, (document_id,))
+
+    _invalidate_document(document_id)
+    return dict(rows[0]) if rows else None
+
 async def delete_document_by_id(document_id: int) -> bool:
     """Delete document and its chunks"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            # Delete chunks first (foreign key constraint)
-            await db.execute("DELETE FROM document_chunks WHERE document_id = ?", (document_id,))
-            
-            # Delete document
-            cursor = await db.execute("DELETE FROM documents WHERE id = ?", (document_id,))
-            await db.commit()
+        async with _writer() as db:
+            # Chunks go with it via ON DELETE CASCADE (foreign_keys=ON on every connection)
+            cursor = await db.execute(_DELETE_DOCUMENT_SQL, (document_id,))
+            deleted = cursor.rowcount > 0
 
-            return cursor.rowcount > 0
+        _invalidate_document(document_id)
+        return deleted
 
     except Exception as e:
         logger.error(f"Error deleting document: {str(e)}")
         return False
 
+async def _read_all(sql: str) -> List[Tuple]:
+    """Run one query on its own pooled reader"""
+    async with _reader() as db:
+        return await db.execute_fetchall(sql)
+
 async def get_database_stats() -> Dict[str, Any]:
     """Get database statistics"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            stats = {}
-
-            # Count documents
-            cursor = await db.execute("SELECT COUNT(*) FROM documents")
-            stats["total_documents"] = (await cursor.fetchone())[0]
-
-            # Count chunks
-            cursor = await db.execute("SELECT COUNT(*) FROM document_chunks")
-            stats["total_chunks"] = (await cursor.fetchone())[0]
-
-            # Count queries
-            cursor = await db.execute("SELECT COUNT(*) FROM user_queries")
-            stats["total_queries"] = (await cursor.fetchone())[0]
-
-            # Get processing status breakdown
-            cursor = await db.execute("""
-                SELECT status, COUNT(*) 
-                FROM documents 
-                GROUP BY status
-            """)
-            status_breakdown = await cursor.fetchall()
-            stats["status_breakdown"] = {status: count for status, count in status_breakdown}
-
-            # Get team breakdown
-            cursor = await db.execute("""
-                SELECT team, COUNT(*) 
-                FROM documents 
-                GROUP BY team
-            """)
-            team_breakdown = await cursor.fetchall()
-            stats["team_breakdown"] = {team: count for team, count in team_breakdown}
-
-            return stats
+        # Each query borrows its own reader; one aiosqlite connection runs its queries in turn
+        totals, status_breakdown, team_breakdown = await asyncio.gather(
+            _read_all(_TOTALS_SQL),
+            _read_all(_STATUS_BREAKDOWN_SQL),
+            _read_all(_TEAM_BREAKDOWN_SQL)
+        )
+        total_documents, total_chunks, total_queries = totals[0]
+
+        stats = {
+            "total_documents": total_documents,
+            "total_chunks": total_chunks,
+            "total_queries": total_queries,
+            "status_breakdown": {status: count for status, count in status_breakdown},
+            "team_breakdown": {team: count for team, count in team_breakdown}
+        }
+
+        return stats
 
     except Exception as e:
         logger.error(f"Error getting database stats: {str(e)}")
@@ -354,43 +879,34 @@ async def get_database_stats() -> Dict[str, Any]:
 async def cleanup_orphaned_chunks():
     """Remove document chunks that don't have parent documents"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            cursor = await db.execute("""
-                DELETE FROM document_chunks 
-                WHERE document_id NOT IN (SELECT id FROM documents)
-            """)
-            await db.commit()
-
+        async with _writer() as db:
+            cursor = await db.execute(_DELETE_ORPHANED_CHUNKS_SQL)
             deleted_count = cursor.rowcount
-            logger.info(f"Cleaned up {deleted_count} orphaned chunks")
-            return deleted_count
+
+        logger.info(f"Cleaned up {deleted_count} orphaned chunks")
+        return deleted_count
 
     except Exception as e:
         logger.error(f"Error cleaning up orphaned chunks: {str(e)}")
         return 0
 
-async def get_recent_queries(limit: int = 10) -> List[Dict]:
-    """Get recent user queries"""
+async def get_recent_queries(limit: int = 10, offset: int = 0,
+                             since: Optional[datetime] = None) -> List[Dict]:
+    """Get recent user queries, newest first, optionally only those created at or after since"""
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            cursor = await db.execute("""
-                SELECT question, confidence, response_time_ms, created_at
-                FROM user_queries 
-                ORDER BY created_at DESC 
-                LIMIT ?
-            """, (limit,))
+        async with _reader() as db:
+            if since is None:
+                cursor = await db.execute(_RECENT_QUERIES_SQL, (limit, offset))
+            else:
+                # created_at is stored by CURRENT_TIMESTAMP as 'YYYY-MM-DD HH:MM:SS' UTC
+                if since.tzinfo is not None:
+                    since = since.astimezone(timezone.utc).replace(tzinfo=None)
+                cursor = await db.execute(
+                    _RECENT_QUERIES_SINCE_SQL,
+                    (since.strftime("%Y-%m-%d %H:%M:%S"), limit, offset)
+                )
             
-            rows = await cursor.fetchall()
-            queries = []
-            for row in rows:
-                queries.append({
-                    "question": row[0],
-                    "confidence": row[1],
-                    "response_time_ms": row[2],
-                    "created_at": row[3]
-                })
-
-            return queries
+            return [dict(row) for row in await cursor.fetchall()]
 
     except Exception as e:
         logger.error(f"Error getting recent queries: {str(e)}")
@@ -3,17 +3,26 @@ Complete Email Service Module for HelperGPT Support Case Extension
 Enhanced with SMTP integration for support cases with department routing
 """
 import os
+import re
 import json
-import smtplib
+import orjson
+import hashlib
+import uuid
+import time
+import socket
+import ipaddress
+import asyncio
+import aiosmtplib
+import aiosqlite
 import logging
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-from typing import Dict, List, Optional, Any
-from datetime import datetime
-from jinja2 import Template
-from openai import AsyncAzureOpenAI
+from io import StringIO
+from email.message import EmailMessage
+from types import MappingProxyType
+from typing import Dict, List, Optional, Any, Tuple
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from jinja2 import Environment
+from openai import AsyncAzureOpenAI, APIConnectionError, RateLimitError, InternalServerError
 from database import get_db_connection
 
 logger = logging.getLogger(__name__)
@@ -22,12 +31,84 @@ logger = logging.getLogger(__name__)
 SMTP_SERVER = os.getenv("SMTP_SERVER", "192.168.1.252")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 EMAIL_USER = os.getenv("EMAIL_USER", "ccd@bsolsystems.com")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+FROM_EMAIL = os.getenv("FROM_EMAIL", EMAIL_USER)
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+# Opt-in: check the relay's STARTTLS certificate and hostname. Off by default, like the
+# smtplib.starttls() this replaced, since internal relays often use self-signed certs.
+SMTP_VALIDATE_CERTS = os.getenv("SMTP_VALIDATE_CERTS", "false").lower() == "true"
+
+# SMTP connection pool; sessions are recycled after SMTP_MAX_MESSAGES_PER_CONN sends
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "5"))
+SMTP_MAX_MESSAGES_PER_CONN = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONN", "100"))
+SMTP_SEND_ATTEMPTS = int(os.getenv("SMTP_SEND_ATTEMPTS", "3"))
+SMTP_RETRY_BASE_DELAY_SECONDS = float(os.getenv("SMTP_RETRY_BASE_DELAY_SECONDS", "1"))
+# Transient server replies worth retrying on a fresh session
+_SMTP_RETRY_CODES = frozenset({421, 450, 451, 452})
+# SMTP_SERVER is resolved once and reused by new sessions until the refresh interval passes
+SMTP_DNS_REFRESH_SECONDS = float(os.getenv("SMTP_DNS_REFRESH_SECONDS", "300"))
+_smtp_address: Optional[str] = None
+_smtp_address_expires = 0.0
 
 # Department emails
 HR_SUPPORT_EMAIL = os.getenv("HR_SUPPORT_EMAIL", "hrsupport@company.com")
 CLOUD_SUPPORT_EMAIL = os.getenv("CLOUD_SUPPORT_EMAIL", "harishsp@bsolsystems.com")
 HARDWARE_SUPPORT_EMAIL = os.getenv("HARDWARE_SUPPORT_EMAIL", "hardware@company.com")
 
+# Department routing tables; read-only after import
+_DEPARTMENT_EMAIL_MAP = MappingProxyType({
+    "hardware": HARDWARE_SUPPORT_EMAIL,
+    "software": "software@company.com",
+    "cloud": CLOUD_SUPPORT_EMAIL,
+    "wfh": HR_SUPPORT_EMAIL,
+    "network": "network@company.com",
+    "security": "security@company.com"
+})
+_DEPARTMENT_DIRECTORY = MappingProxyType({
+    "hardware": {
+        "department_name": "IT Hardware Support",
+        "primary_email": HARDWARE_SUPPORT_EMAIL,
+        "secondary_email": "hardware-manager@company.com",
+        "issue_categories": ["laptop_wont_start", "screen_issues", "keyboard_mouse_issues", "battery_charging"],
+        "priority": "high"
+    },
+    "software": {
+        "department_name": "IT Software Support", 
+        "primary_email": "software@company.com",
+        "secondary_email": "software-manager@company.com",
+        "issue_categories": ["slow_performance", "application_crashes", "login_issues", "system_updates"],
+        "priority": "medium"
+    },
+    "cloud": {
+        "department_name": "Cloud Support Team",
+        "primary_email": CLOUD_SUPPORT_EMAIL,
+        "secondary_email": "cloud-manager@company.com", 
+        "issue_categories": ["aws_issues", "azure_problems", "deployment_problems", "cloud_access"],
+        "priority": "high"
+    },
+    "wfh": {
+        "department_name": "HR Support",
+        "primary_email": HR_SUPPORT_EMAIL,
+        "secondary_email": "hr-manager@company.com",
+        "issue_categories": ["leave_request", "remote_work_policy", "wfh_equipment", "sick_leave"],
+        "priority": "medium"
+    },
+    "network": {
+        "department_name": "Network Support",
+        "primary_email": "network@company.com",
+        "secondary_email": "network-manager@company.com",
+        "issue_categories": ["wifi_connection", "vpn_issues", "internet_slow"],
+        "priority": "medium"
+    },
+    "security": {
+        "department_name": "Security Team",
+        "primary_email": "security@company.com",
+        "secondary_email": "ciso@company.com",
+        "issue_categories": ["malware_suspected", "password_reset", "account_locked"],
+        "priority": "critical"
+    }
+})
+
 # Azure OpenAI for email generation
 azure_openai_client = AsyncAzureOpenAI(
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
@@ -37,58 +118,329 @@ azure_openai_client = AsyncAzureOpenAI(
 
 GPT_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o")
 
+# Email generation bounds each call and retries here, so SDK retries are off for it
+AZURE_OPENAI_TIMEOUT_SECONDS = float(os.getenv("AZURE_OPENAI_TIMEOUT_SECONDS", "15"))
+AZURE_OPENAI_ATTEMPTS = int(os.getenv("AZURE_OPENAI_ATTEMPTS", "3"))
+AZURE_OPENAI_RETRY_BASE_DELAY_SECONDS = float(os.getenv("AZURE_OPENAI_RETRY_BASE_DELAY_SECONDS", "1"))
+AZURE_OPENAI_RETRY_MAX_DELAY_SECONDS = float(os.getenv("AZURE_OPENAI_RETRY_MAX_DELAY_SECONDS", "8"))
+_AOAI_RETRY_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+_email_openai_client = azure_openai_client.with_options(max_retries=0)
+# Caps in-flight completions (streams included) so bursts queue here instead of hitting 429s
+AZURE_OPENAI_MAX_CONCURRENCY = int(os.getenv("AZURE_OPENAI_MAX_CONCURRENCY", "10"))
+_AOAI_SEM = asyncio.Semaphore(AZURE_OPENAI_MAX_CONCURRENCY)
+_aoai_waiting = 0
+
+# Non-critical case emails can be generated through the Azure OpenAI Batch API
+EMAIL_USE_BATCH_API = os.getenv("EMAIL_USE_BATCH_API", "false").lower() == "true"
+EMAIL_BATCH_MAX_CASES = int(os.getenv("EMAIL_BATCH_MAX_CASES", "100"))
+EMAIL_BATCH_FLUSH_SECONDS = float(os.getenv("EMAIL_BATCH_FLUSH_SECONDS", "300"))
+EMAIL_BATCH_POLL_SECONDS = float(os.getenv("EMAIL_BATCH_POLL_SECONDS", "60"))
+_BATCH_TERMINAL_STATUSES = frozenset({"completed", "failed", "expired", "cancelled"})
+
+# Cases generated together in one completion by generate_case_emails_bulk
+EMAIL_BULK_MAX_CASES = int(os.getenv("EMAIL_BULK_MAX_CASES", "5"))
+# Output budget of one bulk completion; keep it within the deployment's output token limit
+EMAIL_BULK_MAX_TOKENS = int(os.getenv("EMAIL_BULK_MAX_TOKENS", "4096"))
+_BULK_EMAIL_DELIMITER = re.compile(r"^---CASE (\d+)---[ \t]*$", re.MULTILINE)
+
+# Email log rows are written in batches; a send is logged at most EMAIL_LOG_FLUSH_SECONDS late
+EMAIL_LOG_BATCH_SIZE = int(os.getenv("EMAIL_LOG_BATCH_SIZE", "50"))
+EMAIL_LOG_FLUSH_SECONDS = float(os.getenv("EMAIL_LOG_FLUSH_SECONDS", "0.5"))
+
+# Conversation sent to the model and shown in the email: recent turns only, capped in size
+EMAIL_HISTORY_MAX_TURNS = int(os.getenv("EMAIL_HISTORY_MAX_TURNS", "10"))
+EMAIL_HISTORY_MAX_CHARS = int(os.getenv("EMAIL_HISTORY_MAX_CHARS", "4000"))
+
+# Generated email bodies, so retries and resends skip the model call
+EMAIL_BODY_CACHE_MAX_ENTRIES = int(os.getenv("EMAIL_BODY_CACHE_MAX_ENTRIES", "256"))
+# The case fields the prompt is built from; not updated_at, which every email-log flush bumps
+_EMAIL_PROMPT_FIELDS = (
+    "case_number", "user_name", "user_email", "issue_category", "severity_level",
+    "assigned_department", "created_at", "issue_description", "troubleshooting_steps"
+)
+
+# Only the columns the email needs; the large text fields come from _CASE_NOTES_SQL
+_CASE_DETAILS_SQL = """
+    SELECT id, case_number, user_name, user_email, issue_category, issue_description,
+           severity_level, status, assigned_department, troubleshooting_steps,
+           created_at
+    FROM support_cases WHERE case_number = ?
+"""
+_CASE_NOTES_SQL = """
+    SELECT case_number, conversation_log, resolution_notes
+    FROM support_cases WHERE case_number = ?
+"""
+_CREATE_EMAIL_LOG_SQL = """
+    CREATE TABLE IF NOT EXISTS email_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        case_number TEXT,
+        recipient_email TEXT,
+        subject TEXT,
+        success BOOLEAN,
+        message_id TEXT,
+        error_message TEXT,
+        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+_LOG_INSERT_SQL = """
+    INSERT INTO email_log (case_number, recipient_email, success, message_id, error_message)
+    VALUES (?, ?, ?, ?, ?)
+"""
+_CASE_UPDATE_SQL = """
+    UPDATE support_cases
+    SET email_sent = (? OR COALESCE(email_sent, 0)), updated_at = CURRENT_TIMESTAMP
+    WHERE case_number = ?
+"""
+
+# Submitted Batch API jobs are recorded on their cases so polling resumes after a restart
+_CASE_COLUMNS_SQL = "PRAGMA table_info(support_cases)"
+_ADD_BATCH_ID_COLUMN_SQL = "ALTER TABLE support_cases ADD COLUMN email_batch_id TEXT"
+_CASE_SET_BATCH_SQL = "UPDATE support_cases SET email_batch_id = ? WHERE case_number = ?"
+_PENDING_BATCH_CASES_SQL = """
+    SELECT email_batch_id, case_number FROM support_cases
+    WHERE email_batch_id IS NOT NULL
+"""
+
+_CASE_EMAIL_SYSTEM_PROMPT = """You are a professional support system generating emails for technical support teams. Create a well-structured, professional email that includes all relevant case information.
+
+Email should include:
+- Professional greeting
+- Case summary with key details
+- User information  
+- Issue description and category
+- Troubleshooting steps attempted
+- Conversation history (if available)
+- Priority level
+- Next steps recommendations
+- Professional closing
+
+Format as HTML email."""
+
+_BULK_EMAIL_INSTRUCTIONS = """Generate {count} separate support case emails, one for each case below.
+Start each email with its delimiter line exactly as given (for example ---CASE 1---) on a line by itself, and output nothing else between emails."""
+
+# Compiled once at import; autoescape keeps case fields from injecting HTML
+_FALLBACK_TMPL = Environment(autoescape=True).from_string("""
+        <html>
+        <body>
+        <h2>Support Case: {{ case.case_number | default('Unknown') }}</h2>
+        
+        <h3>Case Details:</h3>
+        <ul>
+            <li><strong>User:</strong> {{ case.user_name | default('Unknown') }} ({{ case.user_email | default('No email') }})</li>
+            <li><strong>Category:</strong> {{ case.issue_category | default('General') }}</li>
+            <li><strong>Priority:</strong> {{ case.severity_level | default('Medium') }}</li>
+            <li><strong>Created:</strong> {{ case.created_at | default('Unknown') }}</li>
+        </ul>
+        
+        <h3>Issue Description:</h3>
+        <p>{{ case.issue_description | default('No description available') }}</p>
+        
+        <h3>Troubleshooting Steps Attempted:</h3>
+        <p>{{ case.troubleshooting_steps | default('None documented') }}</p>
+        
+        <h3>Conversation History:</h3>
+        <pre>{{ history_json or 'No conversation history' }}</pre>
+        
+        <p><strong>Please review and take appropriate action.</strong></p>
+        
+        <p>Best regards,<br>
+        HelperGPT Support System</p>
+        </body>
+        </html>
+        """)
+
+def _truncate_turn(turn: Any, max_chars: int) -> Any:
+    """Cut long string fields of one conversation turn down to max_chars"""
+    if isinstance(turn, str):
+        return turn if len(turn) <= max_chars else turn[:max_chars] + "..."
+    if isinstance(turn, dict):
+        return {
+            key: (value[:max_chars] + "..." if isinstance(value, str) and len(value) > max_chars else value)
+            for key, value in turn.items()
+        }
+    return turn
+
+def _summarize_history(conversation_history: list, max_turns: int = EMAIL_HISTORY_MAX_TURNS,
+                       max_chars: int = EMAIL_HISTORY_MAX_CHARS) -> list:
+    """Keep a leading system turn and the last max_turns turns, sharing max_chars between them"""
+    if not conversation_history:
+        return conversation_history
+
+    first = conversation_history[0]
+    head = [first] if isinstance(first, dict) and first.get("role") == "system" else []
+    rest = conversation_history[len(head):]
+    tail = rest[-max_turns:] if max_turns > 0 else []
+
+    turns = head[:]
+    if len(rest) > len(tail):
+        turns.append({"role": "system", "content": f"[{len(rest) - len(tail)} earlier turns omitted]"})
+    turns.extend(tail)
+
+    per_turn = max(1, max_chars // max(1, len(head) + len(tail)))
+    return [_truncate_turn(turn, per_turn) for turn in turns]
+
+def _history_json(conversation_history: list) -> str:
+    """Indented JSON of a trimmed conversation for prompts and email bodies; empty if there is none"""
+    if not conversation_history:
+        return ""
+    return orjson.dumps(_summarize_history(conversation_history), option=orjson.OPT_INDENT_2, default=str).decode()
+
+async def _resolve_smtp_server() -> str:
+    """SMTP_SERVER's address, looked up at most once per SMTP_DNS_REFRESH_SECONDS"""
+    global _smtp_address, _smtp_address_expires
+    if _smtp_address is not None and time.monotonic() < _smtp_address_expires:
+        return _smtp_address
+
+    try:
+        ipaddress.ip_address(SMTP_SERVER)
+        address = SMTP_SERVER
+    except ValueError:
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                SMTP_SERVER, SMTP_PORT, type=socket.SOCK_STREAM
+            )
+            address = infos[0][4][0]
+        except OSError as e:
+            # Keep using the last known address rather than failing the send
+            if _smtp_address is not None:
+                logger.warning(f"SMTP DNS refresh failed, keeping {_smtp_address}: {str(e)}")
+                _smtp_address_expires = time.monotonic() + SMTP_DNS_REFRESH_SECONDS
+                return _smtp_address
+            raise
+
+    _smtp_address = address
+    _smtp_address_expires = time.monotonic() + SMTP_DNS_REFRESH_SECONDS
+    return address
+
+class _SMTPSession:
+    """One pooled SMTP connection and the number of messages sent on it"""
+
+    def __init__(self):
+        self.server: Optional[aiosmtplib.SMTP] = None
+        self.sent = 0
+
+    async def ensure_connected(self, max_messages: int):
+        """Reuse the session if it is healthy and under its message budget, else reconnect"""
+        if self.server is not None and self.sent >= max_messages:
+            await self.close()
+
+        if self.server is not None:
+            try:
+                response = await self.server.noop()
+                if response.code == 250:
+                    return
+            except (aiosmtplib.SMTPException, OSError):
+                pass
+            await self.close()
+
+        # Connect to the cached address. The TLS server name stays SMTP_SERVER, so with
+        # SMTP_VALIDATE_CERTS the certificate is checked against the configured name, not the IP
+        server = aiosmtplib.SMTP(
+            hostname=await _resolve_smtp_server(),
+            port=SMTP_PORT,
+            timeout=SMTP_TIMEOUT_SECONDS,
+            start_tls=False,
+            validate_certs=SMTP_VALIDATE_CERTS
+        )
+        await server.connect()
+        await server.starttls(server_hostname=SMTP_SERVER, validate_certs=SMTP_VALIDATE_CERTS)
+        if EMAIL_PASSWORD:
+            await server.login(EMAIL_USER, EMAIL_PASSWORD)
+        self.server = server
+        self.sent = 0
+
+    async def send(self, msg):
+        await self.server.send_message(msg)
+        self.sent += 1
+
+    async def close(self):
+        server, self.server = self.server, None
+        if server is None:
+            return
+        try:
+            await server.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            server.close()
+
+class SMTPPool:
+    """Bounded pool of persistent aiosmtplib sessions, connected lazily on first use"""
+
+    def __init__(self, size: int = SMTP_POOL_SIZE, max_messages: int = SMTP_MAX_MESSAGES_PER_CONN):
+        self.max_messages = max_messages
+        self._sessions = [_SMTPSession() for _ in range(size)]
+        self._idle: asyncio.Queue = asyncio.Queue(maxsize=size)
+        for session in self._sessions:
+            self._idle.put_nowait(session)
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Borrow a connected session; it is dropped if the send fails mid-conversation"""
+        session = await self._idle.get()
+        try:
+            await session.ensure_connected(self.max_messages)
+            yield session
+        except aiosmtplib.SMTPRecipientsRefused:
+            # The session itself is still usable
+            raise
+        except BaseException:
+            await session.close()
+            raise
+        finally:
+            self._idle.put_nowait(session)
+
+    async def warm(self):
+        """Connect an idle session ahead of a send so the handshake overlaps other work"""
+        try:
+            async with self.acquire():
+                pass
+        except Exception as e:
+            logger.warning(f"SMTP warm-up failed: {str(e)}")
+
+    async def close_all(self):
+        """Quit every open session"""
+        for session in self._sessions:
+            await session.close()
+
 class EmailService:
     def __init__(self):
         self.department_directory = {}
+        # get_email_directory's response, built once by initialize_email_directory
+        self._directory_view: Tuple[dict, ...] = ()
         self.email_templates = {}
+        self.smtp_pool = SMTPPool()
+        self._email_body_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._tables_ready = False
+        # Long-lived connection shared by every lookup and email log write
+        self._db: Optional[aiosqlite.Connection] = None
+        self._db_open_lock = asyncio.Lock()
+        self._db_write_lock = asyncio.Lock()
+        # Email log rows waiting for flush_email_logs
+        self._pending_logs: List[tuple] = []
+        self._log_flush_task: Optional[asyncio.Task] = None
+        # Cases waiting for the next Batch API submission: case_number -> (case_data, history, recipients)
+        self._pending_batch: Dict[str, tuple] = {}
+        self._batch_flush_task: Optional[asyncio.Task] = None
+        self._batch_poll_tasks: set = set()
         
     async def initialize_email_directory(self):
         """Initialize email directory with department mappings"""
         try:
-            self.department_directory = {
-                "hardware": {
-                    "department_name": "IT Hardware Support",
-                    "primary_email": HARDWARE_SUPPORT_EMAIL,
-                    "secondary_email": "hardware-manager@company.com",
-                    "issue_categories": ["laptop_wont_start", "screen_issues", "keyboard_mouse_issues", "battery_charging"],
-                    "priority": "high"
-                },
-                "software": {
-                    "department_name": "IT Software Support", 
-                    "primary_email": "software@company.com",
-                    "secondary_email": "software-manager@company.com",
-                    "issue_categories": ["slow_performance", "application_crashes", "login_issues", "system_updates"],
-                    "priority": "medium"
-                },
-                "cloud": {
-                    "department_name": "Cloud Support Team",
-                    "primary_email": CLOUD_SUPPORT_EMAIL,
-                    "secondary_email": "cloud-manager@company.com", 
-                    "issue_categories": ["aws_issues", "azure_problems", "deployment_problems", "cloud_access"],
-                    "priority": "high"
-                },
-                "wfh": {
-                    "department_name": "HR Support",
-                    "primary_email": HR_SUPPORT_EMAIL,
-                    "secondary_email": "hr-manager@company.com",
-                    "issue_categories": ["leave_request", "remote_work_policy", "wfh_equipment", "sick_leave"],
-                    "priority": "medium"
-                },
-                "network": {
-                    "department_name": "Network Support",
-                    "primary_email": "network@company.com",
-                    "secondary_email": "network-manager@company.com",
-                    "issue_categories": ["wifi_connection", "vpn_issues", "internet_slow"],
-                    "priority": "medium"
-                },
-                "security": {
-                    "department_name": "Security Team",
-                    "primary_email": "security@company.com",
-                    "secondary_email": "ciso@company.com",
-                    "issue_categories": ["malware_suspected", "password_reset", "account_locked"],
-                    "priority": "critical"
+            self.department_directory = _DEPARTMENT_DIRECTORY
+            self._directory_view = tuple(
+                {
+                    "category": category,
+                    "department_name": info["department_name"],
+                    "primary_email": info["primary_email"],
+                    "secondary_email": info.get("secondary_email"),
+                    "issue_categories": info["issue_categories"],
+                    "priority": info["priority"]
                 }
-            }
+                for category, info in self.department_directory.items()
+            )
+            
+            await self._ensure_tables(await self._conn())
+            await self.resume_email_batches()
             
             logger.info("Email directory initialized successfully")
             
@@ -103,59 +455,273 @@ class EmailService:
             if not case_data:
                 return {"success": False, "error": "Case not found"}
             
-            # Determine recipient email
-            recipient_email = department_email or self.get_department_email(case_data.get("issue_category"))
-            
-            # Generate professional email content
-            email_content = await self.generate_case_email_content(case_data, conversation_history)
+            # Determine recipient emails
+            recipients = [department_email] if department_email else self.get_case_recipients(case_data.get("issue_category"))
             
-            # Send via SMTP
-            smtp_result = await self.send_smtp_email(
-                to_email=recipient_email,
-                subject=f"Support Case {case_number} - {case_data.get('issue_category', 'General').title()} Issue",
-                body=email_content,
-                case_number=case_number
+            # Non-critical cases can wait for the Batch API; critical ones always go out now
+            if EMAIL_USE_BATCH_API and str(case_data.get("severity_level", "")).lower() != "critical":
+                return await self.queue_case_email_for_batch(case_data, conversation_history, recipients)
+
+            # Generate professional email content while an SMTP session connects
+            email_content, _ = await asyncio.gather(
+                self.generate_case_email_content(case_data, conversation_history),
+                self.smtp_pool.warm()
             )
-            
-            # Log email sent
-            await self.log_email_sent(case_number, recipient_email, smtp_result)
-            
-            return {
-                "success": smtp_result["success"],
-                "recipients": [recipient_email],
-                "email_id": smtp_result.get("message_id"),
-                "error": smtp_result.get("error")
-            }
+            return await self._deliver_case_email(case_data, recipients, email_content)
             
         except Exception as e:
             logger.error(f"Error sending support case email: {str(e)}")
             return {"success": False, "error": str(e)}
+
+    def get_case_recipients(self, category: str) -> List[str]:
+        """Primary and secondary contacts for a category, falling back to the department email"""
+        department = self.department_directory.get(category)
+        if not department:
+            return [self.get_department_email(category)]
+        return [email for email in (department["primary_email"], department.get("secondary_email")) if email]
+
+    async def _send_one(self, recipient: str, subject: str, body: str, case_number: str) -> dict:
+        """Send to one recipient and record it in the email log"""
+        smtp_result = await self.send_smtp_email(
+            to_email=recipient,
+            subject=subject,
+            body=body,
+            case_number=case_number
+        )
+        await self.log_email_sent(case_number, recipient, smtp_result)
+        return smtp_result
+
+    async def _deliver_case_email(self, case_data: dict, recipients: List[str], email_content: str) -> dict:
+        """Send a generated case email to every recipient concurrently"""
+        case_number = case_data.get("case_number")
+        subject = f"Support Case {case_number} - {case_data.get('issue_category', 'General').title()} Issue"
+
+        # return_exceptions so one failed recipient doesn't cancel the others
+        outcomes = await asyncio.gather(
+            *[self._send_one(recipient, subject, email_content, case_number) for recipient in recipients],
+            return_exceptions=True
+        )
+        results = {
+            recipient: (
+                {"success": False, "error": str(outcome)} if isinstance(outcome, BaseException) else outcome
+            )
+            for recipient, outcome in zip(recipients, outcomes)
+        }
+
+        sent = [result for result in results.values() if result["success"]]
+        errors = [f"{recipient}: {result.get('error')}" for recipient, result in results.items() if not result["success"]]
+        return {
+            "success": bool(sent),
+            "recipients": recipients,
+            "email_id": sent[0].get("message_id") if sent else None,
+            "error": "; ".join(errors) if errors else None,
+            "results": results
+        }
+
+    async def queue_case_email_for_batch(self, case_data: dict, conversation_history: list, recipients: List[str]) -> dict:
+        """Queue a case email for the next Batch API submission"""
+        case_number = case_data["case_number"]
+        self._pending_batch[case_number] = (case_data, conversation_history, recipients)
+
+        if len(self._pending_batch) >= EMAIL_BATCH_MAX_CASES:
+            await self.flush_email_batch()
+        elif self._batch_flush_task is None:
+            self._batch_flush_task = asyncio.create_task(self._flush_email_batch_later())
+
+        logger.info(f"Queued case {case_number} email for batch generation")
+        return {"success": True, "queued": True, "recipients": recipients}
+
+    async def _flush_email_batch_later(self):
+        """Submit the pending batch after EMAIL_BATCH_FLUSH_SECONDS"""
+        await asyncio.sleep(EMAIL_BATCH_FLUSH_SECONDS)
+        self._batch_flush_task = None
+        await self.flush_email_batch()
+
+    async def flush_email_batch(self) -> Optional[str]:
+        """Submit all pending case emails as one Batch API job and start polling it"""
+        if self._batch_flush_task is not None and self._batch_flush_task is not asyncio.current_task():
+            self._batch_flush_task.cancel()
+        self._batch_flush_task = None
+
+        pending, self._pending_batch = self._pending_batch, {}
+        if not pending:
+            return None
+
+        try:
+            batch_id = await self.generate_case_email_content_batch(
+                [(case_data, history) for case_data, history, _ in pending.values()]
+            )
+        except Exception as e:
+            # Don't lose the cases: send them through the real-time path instead
+            logger.error(f"Batch submission failed, sending {len(pending)} case emails directly: {str(e)}")
+            await self._send_pending_directly(pending)
+            return None
+
+        await self._record_email_batch(batch_id, pending)
+        self._start_batch_dispatch(batch_id, pending)
+        return batch_id
+
+    async def _send_pending_directly(self, pending: Dict[str, tuple]):
+        """Generate and send queued case emails through the real-time path"""
+        pending = list(pending.values())
+        bodies = await self._generate_case_email_bodies([(case_data, history) for case_data, history, _ in pending])
+        for (case_data, _, recipients), email_content in zip(pending, bodies):
+            try:
+                await self._deliver_case_email(case_data, recipients, email_content)
+            except Exception as e:
+                logger.error(f"Error sending case {case_data.get('case_number')} email: {str(e)}")
+
+    def _start_batch_dispatch(self, batch_id: str, pending: Dict[str, tuple]):
+        """Poll a submitted batch in the background and send its emails when it finishes"""
+        task = asyncio.create_task(self._dispatch_email_batch(batch_id, pending))
+        self._batch_poll_tasks.add(task)
+        task.add_done_callback(self._batch_poll_tasks.discard)
+
+    async def _record_email_batch(self, batch_id: Optional[str], case_numbers):
+        """Store the batch id on its cases, or clear it with None once their emails are out"""
+        try:
+            conn = await self._conn()
+            async with self._db_write_lock:
+                await conn.executemany(_CASE_SET_BATCH_SQL, [(batch_id, case_number) for case_number in case_numbers])
+                await conn.commit()
+        except Exception as e:
+            logger.error(f"Error recording email batch {batch_id}: {str(e)}")
+
+    async def resume_email_batches(self):
+        """Resume polling batches submitted before a restart"""
+        try:
+            conn = await self._conn()
+            async with conn.execute(_PENDING_BATCH_CASES_SQL) as cursor:
+                rows = await cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error loading submitted email batches: {str(e)}")
+            return
+
+        batches: Dict[str, List[str]] = {}
+        for batch_id, case_number in rows:
+            batches.setdefault(batch_id, []).append(case_number)
+        for batch_id, case_numbers in batches.items():
+            pending = {}
+            for case_number in case_numbers:
+                case_data = await self.get_case_details(case_number)
+                if case_data:
+                    # The conversation isn't stored with the case; it only feeds the template fallback
+                    pending[case_number] = (case_data, [], self.get_case_recipients(case_data.get("issue_category")))
+            if pending:
+                logger.info(f"Resuming email batch {batch_id} for {len(pending)} cases")
+                self._start_batch_dispatch(batch_id, pending)
+
+    async def generate_case_email_content_batch(self, cases: List[tuple]) -> str:
+        """Upload (case_data, conversation_history) prompts as a Batch API job and return its id"""
+        lines = []
+        for case_data, conversation_history in cases:
+            lines.append(json.dumps({
+                "custom_id": case_data["case_number"],
+                "method": "POST",
+                "url": "/chat/completions",
+                "body": {
+                    "model": GPT_DEPLOYMENT,
+                    "messages": self._build_case_email_messages(case_data, conversation_history),
+                    "max_tokens": 1500,
+                    "temperature": 0.3
+                }
+            }))
+
+        batch_file = await azure_openai_client.files.create(
+            file=("case_emails.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = await azure_openai_client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/chat/completions",
+            completion_window="24h"
+        )
+        logger.info(f"Submitted email batch {batch.id} with {len(lines)} cases")
+        return batch.id
+
+    async def _dispatch_email_batch(self, batch_id: str, pending: Dict[str, tuple]):
+        """Poll a batch until it finishes, then send each generated email"""
+        try:
+            while True:
+                batch = await azure_openai_client.batches.retrieve(batch_id)
+                if batch.status in _BATCH_TERMINAL_STATUSES:
+                    break
+                await asyncio.sleep(EMAIL_BATCH_POLL_SECONDS)
+
+            contents = {}
+            if batch.status == "completed" and batch.output_file_id:
+                output = await azure_openai_client.files.content(batch.output_file_id)
+                for line in output.text.splitlines():
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    try:
+                        choice = result["response"]["body"]["choices"][0]
+                        contents[result["custom_id"]] = choice["message"]["content"].strip()
+                    except (KeyError, IndexError, TypeError):
+                        continue
+            else:
+                logger.error(f"Email batch {batch_id} ended with status {batch.status}")
+
+            for case_number, (case_data, history, recipients) in pending.items():
+                email_content = contents.get(case_number)
+                if not email_content or len(email_content) < 100:
+                    email_content = self.get_fallback_email_template(case_data, history)
+                await self._deliver_case_email(case_data, recipients, email_content)
+            await self._record_email_batch(None, pending)
+
+        except Exception as e:
+            logger.error(f"Error dispatching email batch {batch_id}: {str(e)}")
     
+    async def close(self):
+        """Send queued batch emails directly, stop batch polling, write pending email logs and close connections"""
+        if self._batch_flush_task is not None:
+            self._batch_flush_task.cancel()
+            self._batch_flush_task = None
+        pending, self._pending_batch = self._pending_batch, {}
+        if pending:
+            logger.info(f"Sending {len(pending)} queued case emails directly before shutdown")
+            await self._send_pending_directly(pending)
+        # Submitted batches keep their id on the case row and are resumed on the next start
+        poll_tasks = list(self._batch_poll_tasks)
+        for task in poll_tasks:
+            task.cancel()
+        await asyncio.gather(*poll_tasks, return_exceptions=True)
+
+        await self.flush_email_logs()
+        await self.smtp_pool.close_all()
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
     async def send_smtp_email(self, to_email: str, subject: str, body: str, case_number: str = None):
         """Send email via SMTP"""
         try:
-            # Create message
-            msg = MIMEMultipart()
+            # Single-part HTML message; set_content picks the transfer encoding
+            msg = EmailMessage()
             msg['From'] = FROM_EMAIL
             msg['To'] = to_email
             msg['Subject'] = subject
+            msg.set_content(body, subtype='html')
             
-            # Add body
-            msg.attach(MIMEText(body, 'html'))
-            
-            # Connect to SMTP server
-            with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                server.starttls()
-                if EMAIL_PASSWORD:
-                    server.login(EMAIL_USER, EMAIL_PASSWORD)
-                
-                # Send email
-                server.send_message(msg)
+            for attempt in range(SMTP_SEND_ATTEMPTS):
+                try:
+                    async with self.smtp_pool.acquire() as session:
+                        await session.send(msg)
+                    break
+                except (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPServerDisconnected) as e:
+                    code = getattr(e, "code", None)
+                    transient = code is None or code in _SMTP_RETRY_CODES
+                    if not transient or attempt == SMTP_SEND_ATTEMPTS - 1:
+                        raise
+                    delay = SMTP_RETRY_BASE_DELAY_SECONDS * (2 ** attempt)
+                    logger.warning(f"SMTP send to {to_email} failed ({code}), retrying in {delay:.0f}s")
+                    await asyncio.sleep(delay)
                 
             logger.info(f"Email sent successfully to {to_email} for case {case_number}")
             return {
                 "success": True,
-                "message_id": f"{case_number}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+                "message_id": f"{case_number}_{uuid.uuid4().hex}"
             }
             
         except Exception as e:
@@ -164,36 +730,14 @@ class EmailService:
     
     def get_department_email(self, category: str) -> str:
         """Get department email based on category"""
-        department_emails = {
-            "hardware": HARDWARE_SUPPORT_EMAIL,
-            "software": "software@company.com", 
-            "cloud": CLOUD_SUPPORT_EMAIL,
-            "wfh": HR_SUPPORT_EMAIL,
-            "network": "network@company.com",
-            "security": "security@company.com"
-        }
-        return department_emails.get(category, "support@company.com")
+        return _DEPARTMENT_EMAIL_MAP.get(category, "support@company.com")
     
-    async def generate_case_email_content(self, case_data: dict, conversation_history: list) -> str:
-        """Generate professional email content for support case"""
-        try:
-            # Use AI to generate professional email content
-            system_prompt = """You are a professional support system generating emails for technical support teams. Create a well-structured, professional email that includes all relevant case information.
-
-Email should include:
-- Professional greeting
-- Case summary with key details
-- User information  
-- Issue description and category
-- Troubleshooting steps attempted
-- Conversation history (if available)
-- Priority level
-- Next steps recommendations
-- Professional closing
-
-Format as HTML email."""
-            
-            user_prompt = f"""Generate professional support case email:
+    def _build_case_email_messages(self, case_data: dict, conversation_history: list,
+                                   history_json: Optional[str] = None) -> List[dict]:
+        """Build the chat messages that ask the model for a case email"""
+        if history_json is None:
+            history_json = _history_json(conversation_history)
+        user_prompt = f"""Generate professional support case email:
 
 Case Details:
 - Case Number: {case_data.get('case_number', 'Unknown')}
@@ -210,164 +754,294 @@ Troubleshooting Steps Attempted:
 {case_data.get('troubleshooting_steps', 'None documented')}
 
 Conversation History:
-{json.dumps(conversation_history, indent=2) if conversation_history else 'No conversation history'}
+{history_json or 'No conversation history'}
 
 Create a professional email to the support team."""
-            
-            response = await azure_openai_client.chat.completions.create(
+        return [
+            {"role": "system", "content": _CASE_EMAIL_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _email_body_cache_key(self, case_data: dict, history_json: str) -> str:
+        """Key a generated body by the case fields in its prompt and the serialized conversation"""
+        raw = "|".join(str(case_data.get(field)) for field in _EMAIL_PROMPT_FIELDS) + f"|{history_json}"
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+    async def _stream_completion(self, messages: List[dict], max_tokens: int) -> StringIO:
+        """Stream one completion while holding an _AOAI_SEM slot"""
+        global _aoai_waiting
+        if _AOAI_SEM.locked():
+            logger.info(f"Email generation waiting for an Azure OpenAI slot ({_aoai_waiting} already queued)")
+        _aoai_waiting += 1
+        try:
+            await _AOAI_SEM.acquire()
+        finally:
+            _aoai_waiting -= 1
+
+        try:
+            stream = await _email_openai_client.chat.completions.create(
                 model=GPT_DEPLOYMENT,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=1500,
-                temperature=0.3
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=0.3,
+                stream=True,
+                timeout=AZURE_OPENAI_TIMEOUT_SECONDS
+            )
+
+            buffer = StringIO()
+            async for chunk in stream:
+                # Azure can send chunks without choices (e.g. content filter results)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    buffer.write(chunk.choices[0].delta.content)
+            return buffer
+        finally:
+            _AOAI_SEM.release()
+
+    async def _call_openai_with_retry(self, messages: List[dict], max_tokens: int = 1500) -> Optional[str]:
+        """Stream one completion, retrying transient failures; None if every attempt fails"""
+        for attempt in range(AZURE_OPENAI_ATTEMPTS):
+            try:
+                buffer = await self._stream_completion(messages, max_tokens)
+                if attempt:
+                    logger.info(f"Email generation succeeded after {attempt} retries")
+                return buffer.getvalue().strip()
+
+            except _AOAI_RETRY_ERRORS as e:
+                if attempt + 1 >= AZURE_OPENAI_ATTEMPTS:
+                    logger.error(f"Email generation failed after {attempt + 1} attempts: {str(e)}")
+                    return None
+                delay = min(AZURE_OPENAI_RETRY_MAX_DELAY_SECONDS, AZURE_OPENAI_RETRY_BASE_DELAY_SECONDS * (2 ** attempt))
+                logger.warning(f"Email generation attempt {attempt + 1} failed ({type(e).__name__}), retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+
+    async def generate_case_email_content(self, case_data: dict, conversation_history: list,
+                                          history_json: Optional[str] = None) -> str:
+        """Generate professional email content for support case"""
+        if history_json is None:
+            history_json = _history_json(conversation_history)
+        try:
+            cache_key = self._email_body_cache_key(case_data, history_json)
+            cached = self._email_body_cache.get(cache_key)
+            if cached is not None:
+                self._email_body_cache.move_to_end(cache_key)
+                return cached
+
+            # Use AI to generate professional email content
+            email_content = await self._call_openai_with_retry(
+                self._build_case_email_messages(case_data, conversation_history, history_json)
             )
-            
-            email_content = response.choices[0].message.content.strip()
             
             # Fallback template if AI generation fails
             if not email_content or len(email_content) < 100:
-                email_content = self.get_fallback_email_template(case_data, conversation_history)
-            
+                return self.get_fallback_email_template(case_data, conversation_history, history_json)
+
+            self._cache_email_body(cache_key, email_content)
             return email_content
             
         except Exception as e:
             logger.error(f"Error generating email content: {str(e)}")
-            return self.get_fallback_email_template(case_data, conversation_history)
+            return self.get_fallback_email_template(case_data, conversation_history, history_json)
     
-    def get_fallback_email_template(self, case_data: dict, conversation_history: list) -> str:
+    def _cache_email_body(self, cache_key: str, email_content: str):
+        """Store a generated body, evicting the least recently used"""
+        self._email_body_cache[cache_key] = email_content
+        while len(self._email_body_cache) > EMAIL_BODY_CACHE_MAX_ENTRIES:
+            self._email_body_cache.popitem(last=False)
+
+    async def generate_case_emails_bulk(self, cases: List[tuple]) -> List[str]:
+        """Generate bodies for (case_data, conversation_history) pairs with one completion"""
+        bodies: List[Optional[str]] = [None] * len(cases)
+        history_jsons = [_history_json(history) for _, history in cases]
+        keys = [self._email_body_cache_key(case_data, hj) for (case_data, _), hj in zip(cases, history_jsons)]
+        todo = []
+        for i, key in enumerate(keys):
+            cached = self._email_body_cache.get(key)
+            if cached is not None:
+                self._email_body_cache.move_to_end(key)
+                bodies[i] = cached
+            else:
+                todo.append(i)
+
+        if len(todo) == 1:
+            case_data, history = cases[todo[0]]
+            bodies[todo[0]] = await self.generate_case_email_content(case_data, history, history_jsons[todo[0]])
+        elif todo:
+            prompt = StringIO()
+            prompt.write(_BULK_EMAIL_INSTRUCTIONS.format(count=len(todo)))
+            for n, i in enumerate(todo, start=1):
+                case_data, history = cases[i]
+                prompt.write(f"\n\n---CASE {n}---\n")
+                prompt.write(self._build_case_email_messages(case_data, history, history_jsons[i])[1]["content"])
+
+            content = await self._call_openai_with_retry(
+                [
+                    {"role": "system", "content": _CASE_EMAIL_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt.getvalue()}
+                ],
+                max_tokens=min(1500 * len(todo), EMAIL_BULK_MAX_TOKENS)
+            ) or ""
+
+            # re.split yields [preamble, n1, body1, n2, body2, ...]
+            parts = _BULK_EMAIL_DELIMITER.split(content)
+            generated = {int(n): body.strip() for n, body in zip(parts[1::2], parts[2::2])}
+            for n, i in enumerate(todo, start=1):
+                case_data, history = cases[i]
+                email_content = generated.get(n, "")
+                if len(email_content) < 100:
+                    bodies[i] = self.get_fallback_email_template(case_data, history, history_jsons[i])
+                else:
+                    self._cache_email_body(keys[i], email_content)
+                    bodies[i] = email_content
+
+        return bodies
+
+    async def _generate_case_email_bodies(self, cases: List[tuple]) -> List[str]:
+        """Bodies for (case_data, conversation_history) pairs in bulk chunks, templates where generation fails"""
+        bodies: List[str] = []
+        try:
+            for start in range(0, len(cases), EMAIL_BULK_MAX_CASES):
+                bodies.extend(await self.generate_case_emails_bulk(cases[start:start + EMAIL_BULK_MAX_CASES]))
+        except Exception as e:
+            logger.error(f"Error generating bulk email content: {str(e)}")
+            bodies.extend(
+                self.get_fallback_email_template(case_data, history) for case_data, history in cases[len(bodies):]
+            )
+        return bodies
+
+    async def send_support_case_emails(self, cases: List[tuple]) -> List[dict]:
+        """Send emails for many (case_number, conversation_history) pairs, generating them in bulk"""
+        details = await asyncio.gather(*[self.get_case_details(case_number) for case_number, _ in cases])
+        found = [(case_data, history) for case_data, (_, history) in zip(details, cases) if case_data]
+
+        bodies = await self._generate_case_email_bodies(found)
+
+        delivered = iter(await asyncio.gather(
+            *[
+                self._deliver_case_email(case_data, self.get_case_recipients(case_data.get("issue_category")), body)
+                for (case_data, _), body in zip(found, bodies)
+            ],
+            return_exceptions=True
+        ))
+        results = []
+        for case_data in details:
+            if not case_data:
+                results.append({"success": False, "error": "Case not found"})
+                continue
+            outcome = next(delivered)
+            results.append({"success": False, "error": str(outcome)} if isinstance(outcome, BaseException) else outcome)
+        return results
+
+    def get_fallback_email_template(self, case_data: dict, conversation_history: list,
+                                    history_json: Optional[str] = None) -> str:
         """Fallback email template"""
-        return f"""
-        <html>
-        <body>
-        <h2>Support Case: {case_data.get('case_number', 'Unknown')}</h2>
-        
-        <h3>Case Details:</h3>
-        <ul>
-            <li><strong>User:</strong> {case_data.get('user_name', 'Unknown')} ({case_data.get('user_email', 'No email')})</li>
-            <li><strong>Category:</strong> {case_data.get('issue_category', 'General')}</li>
-            <li><strong>Priority:</strong> {case_data.get('severity_level', 'Medium')}</li>
-            <li><strong>Created:</strong> {case_data.get('created_at', 'Unknown')}</li>
-        </ul>
-        
-        <h3>Issue Description:</h3>
-        <p>{case_data.get('issue_description', 'No description available')}</p>
-        
-        <h3>Troubleshooting Steps Attempted:</h3>
-        <p>{case_data.get('troubleshooting_steps', 'None documented')}</p>
-        
-        <h3>Conversation History:</h3>
-        <pre>{json.dumps(conversation_history, indent=2) if conversation_history else 'No conversation history'}</pre>
-        
-        <p><strong>Please review and take appropriate action.</strong></p>
-        
-        <p>Best regards,<br>
-        HelperGPT Support System</p>
-        </body>
-        </html>
-        """
+        if history_json is None:
+            history_json = _history_json(conversation_history)
+        return _FALLBACK_TMPL.render(case=case_data, history_json=history_json)
     
     async def get_case_details(self, case_number: str) -> Optional[dict]:
-        """Get support case details from database"""
+        """Get the support case fields needed to build its email"""
         try:
-            conn = await get_db_connection()
-            cursor = await conn.execute("""
-                SELECT * FROM support_cases WHERE case_number = ?
-            """, (case_number,))
-            row = await cursor.fetchone()
-            await conn.close()
+            conn = await self._conn()
+            async with conn.execute(_CASE_DETAILS_SQL, (case_number,)) as cursor:
+                row = await cursor.fetchone()
             
-            if row:
-                return {
-                    "id": row[0],
-                    "case_number": row[1],
-                    "user_name": row[2],
-                    "user_email": row[3],
-                    "issue_category": row[4],
-                    "issue_description": row[5],
-                    "severity_level": row[6],
-                    "status": row[7],
-                    "assigned_department": row[8],
-                    "assigned_email": row[9],
-                    "conversation_log": row[10],
-                    "troubleshooting_steps": row[11],
-                    "resolution_notes": row[12],
-                    "created_at": row[13],
-                    "updated_at": row[14],
-                    "resolved_at": row[15],
-                    "escalated": bool(row[16]) if row[16] is not None else False
-                }
-            return None
+            return dict(row) if row else None
             
         except Exception as e:
             logger.error(f"Error getting case details: {str(e)}")
             return None
+
+    async def get_case_notes(self, case_number: str) -> Optional[dict]:
+        """Get the large conversation_log and resolution_notes fields of a case"""
+        try:
+            conn = await self._conn()
+            async with conn.execute(_CASE_NOTES_SQL, (case_number,)) as cursor:
+                row = await cursor.fetchone()
+
+            return dict(row) if row else None
+
+        except Exception as e:
+            logger.error(f"Error getting case notes: {str(e)}")
+            return None
     
+    async def _conn(self) -> aiosqlite.Connection:
+        """Open the shared connection on first use"""
+        if self._db is None:
+            async with self._db_open_lock:
+                if self._db is None:
+                    db = await get_db_connection()
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    db.row_factory = aiosqlite.Row
+                    self._db = db
+        return self._db
+
+    async def _ensure_tables(self, conn):
+        """Create the email log table and add the batch id column to support_cases once per process"""
+        if self._tables_ready:
+            return
+        await conn.execute(_CREATE_EMAIL_LOG_SQL)
+        async with conn.execute(_CASE_COLUMNS_SQL) as cursor:
+            columns = [row[1] for row in await cursor.fetchall()]
+        # support_cases is created by the support manager; new tables already have the column
+        if columns and "email_batch_id" not in columns:
+            await conn.execute(_ADD_BATCH_ID_COLUMN_SQL)
+        await conn.commit()
+        self._tables_ready = True
+
     async def log_email_sent(self, case_number: str, recipient: str, smtp_result: dict):
-        """Log email sending to database"""
+        """Queue an email log row; rows are written in batches by flush_email_logs"""
+        self._pending_logs.append((
+            case_number,
+            recipient,
+            smtp_result.get("success", False),
+            smtp_result.get("message_id"),
+            smtp_result.get("error")
+        ))
+        if len(self._pending_logs) >= EMAIL_LOG_BATCH_SIZE:
+            await self.flush_email_logs()
+        elif self._log_flush_task is None:
+            self._log_flush_task = asyncio.create_task(self._flush_email_logs_later())
+
+    async def _flush_email_logs_later(self):
+        """Write queued log rows after EMAIL_LOG_FLUSH_SECONDS"""
+        await asyncio.sleep(EMAIL_LOG_FLUSH_SECONDS)
+        self._log_flush_task = None
+        await self.flush_email_logs()
+
+    async def flush_email_logs(self):
+        """Insert queued email logs and mark their cases in one transaction"""
+        if self._log_flush_task is not None and self._log_flush_task is not asyncio.current_task():
+            self._log_flush_task.cancel()
+        self._log_flush_task = None
+
+        rows, self._pending_logs = self._pending_logs, []
+        if not rows:
+            return
+
         try:
-            conn = await get_db_connection()
-            
-            # Create email log table if it doesn't exist
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS email_log (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    case_number TEXT,
-                    recipient_email TEXT,
-                    subject TEXT,
-                    success BOOLEAN,
-                    message_id TEXT,
-                    error_message TEXT,
-                    sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Insert email log
-            await conn.execute("""
-                INSERT INTO email_log (case_number, recipient_email, success, message_id, error_message)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                case_number,
-                recipient,
-                smtp_result.get("success", False),
-                smtp_result.get("message_id"),
-                smtp_result.get("error")
-            ))
+            conn = await self._conn()
             
-            # Update support case to mark email sent
-            await conn.execute("""
-                UPDATE support_cases 
-                SET email_sent = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE case_number = ?
-            """, (smtp_result.get("success", False), case_number))
+            # The lock keeps concurrent flushes from interleaving on the shared connection
+            async with self._db_write_lock:
+                # No-op after startup; covers use before initialize_email_directory
+                await self._ensure_tables(conn)
+                await conn.execute("BEGIN IMMEDIATE")
+                try:
+                    await conn.executemany(_LOG_INSERT_SQL, rows)
+                    await conn.executemany(_CASE_UPDATE_SQL, [(row[2], row[0]) for row in rows])
+                    await conn.commit()
+                except BaseException:
+                    await conn.rollback()
+                    raise
             
-            await conn.commit()
-            await conn.close()
-            
-            logger.info(f"Email log recorded for case {case_number}")
+            logger.info(f"Email log recorded for {len(rows)} sends")
             
         except Exception as e:
             logger.error(f"Error logging email: {str(e)}")
     
-    async def get_email_directory(self) -> List[dict]:
-        """Get email directory for all departments"""
-        try:
-            directory = []
-            for category, info in self.department_directory.items():
-                directory.append({
-                    "category": category,
-                    "department_name": info["department_name"],
-                    "primary_email": info["primary_email"],
-                    "secondary_email": info.get("secondary_email"),
-                    "issue_categories": info["issue_categories"],
-                    "priority": info["priority"]
-                })
-            return directory
-            
-        except Exception as e:
-            logger.error(f"Error getting email directory: {str(e)}")
-            return []
+    async def get_email_directory(self) -> Tuple[dict, ...]:
+        """Get email directory for all departments; callers must treat it as read-only"""
+        return self._directory_view
     
     async def test_email_configuration(self):
         """Test SMTP email configuration"""
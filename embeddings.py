@@ -3,17 +3,24 @@ Embeddings module for HelperGPT
 Vector embeddings generation using Azure OpenAI and FAISS similarity search
 """
 import os
-import json
+import time
+import hashlib
 import numpy as np
 import faiss
 import logging
 from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
 from datetime import datetime
 import asyncio
 import aiofiles
 from openai import AsyncAzureOpenAI
 from dotenv import load_dotenv
-from database import insert_document_chunk, update_document_status, get_db_connection, insert_document
+from database import (
+    insert_document_chunks, update_document_status, insert_document, embedding_to_blob,
+    blob_to_embedding, decompress_chunk_text, get_chunks_by_ids, get_chunk_embeddings, get_chunk_metadata,
+    get_completed_chunk_ids, get_completed_documents, get_chunks_for_reindex, update_chunk_embeddings,
+    get_chunks_after
+)
 from utils import chunk_text
 from storage import get_file_path
 
@@ -26,73 +33,628 @@ AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
 EMBEDDING_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-ada-002")
 FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "faiss_index.bin")
+# Chunk metadata for the saved index; bump the version when ChunkMetadata's columns change
+FAISS_METADATA_PATH = FAISS_INDEX_PATH + ".meta.npz"
+METADATA_CACHE_VERSION = 1
 EMBEDDING_DIMENSION = 1536  # Azure OpenAI Ada-002 embedding dimension
 
+# Texts per embeddings request (the API accepts up to 2048 inputs)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "128"))
+# Embedding requests in flight at once across all documents being processed
+MAX_CONCURRENT_EMBEDDINGS = int(os.getenv("MAX_CONCURRENT_EMBEDDINGS", "16"))
+_embedding_semaphore = asyncio.Semaphore(MAX_CONCURRENT_EMBEDDINGS)
+
+# Index built for new and reindexed corpora:
+#   "hnsw"     approximate, sub-linear search over float32 vectors (6 KB per vector)
+#   "hnsw_sq"  HNSW over int8 scalar-quantized vectors (~1.5 KB per vector, small recall loss)
+#   "sq"       exact scan over int8 scalar-quantized vectors
+#   "flat"     exact scan over float32 vectors
+#   "ivf_pq"   inverted lists over product-quantized codes (see FAISS_IVF_* below)
+# The int8 codecs are trained on the first batch added, so they suit corpora whose
+# first document is representative; reindex to retrain.
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "hnsw").lower()
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "100"))
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+# Quantized indexes fetch this many candidates and rescore them with the stored float32 embeddings
+FAISS_RERANK_CANDIDATES = int(os.getenv("FAISS_RERANK_CANDIDATES", "20"))
+# "ivf_pq": inverted lists over product-quantized codes (FAISS_PQ_M bytes per vector). Vectors are
+# kept in an exact staging index until FAISS_IVF_TRAIN_SIZE of them are available to train on.
+FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "1024"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "64"))
+FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "10"))
+FAISS_IVF_TRAIN_SIZE = int(os.getenv("FAISS_IVF_TRAIN_SIZE", "10000"))
+
+# Documents prepared at once by reindex_all_documents
+REINDEX_MAX_CONCURRENT_DOCS = int(os.getenv("REINDEX_MAX_CONCURRENT_DOCS", "4"))
+
+# Opt-in: memory-map the saved index read-only so uvicorn workers share its pages
+FAISS_MMAP = os.getenv("FAISS_MMAP", "0") == "1"
+
+# Ingest saves the index once FAISS_SAVE_EVERY_DOCS documents pile up or FAISS_SAVE_DELAY_SECONDS
+# pass, instead of rewriting it after every document. Vectors added since the last save are
+# recovered from the stored chunk embeddings on the next load.
+FAISS_SAVE_DELAY_SECONDS = float(os.getenv("FAISS_SAVE_DELAY_SECONDS", "30"))
+FAISS_SAVE_EVERY_DOCS = int(os.getenv("FAISS_SAVE_EVERY_DOCS", "64"))
+
+# HNSW can't remove vectors: a deleted document's chunks leave document_metadata at once, searches
+# over-fetch by the number of dead vectors, and FAISS_COMPACT_DELAY_SECONDS after the first delete
+# the index is rebuilt from its live vectors.
+FAISS_COMPACT_DELAY_SECONDS = float(os.getenv("FAISS_COMPACT_DELAY_SECONDS", "60"))
+
+# Once the index is large enough that scanning it dominates, concurrent searches arriving within
+# SEARCH_BATCH_WINDOW_MS are stacked into one index.search call
+SEARCH_BATCH_MIN_VECTORS = int(os.getenv("SEARCH_BATCH_MIN_VECTORS", "50000"))
+SEARCH_BATCH_WINDOW_MS = float(os.getenv("SEARCH_BATCH_WINDOW_MS", "5"))
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", "64"))
+
+# FAISS defaults to one OpenMP thread per core, which oversubscribes the CPU under concurrent requests
+FAISS_NUM_THREADS = int(os.getenv("FAISS_NUM_THREADS", "2"))
+faiss.omp_set_num_threads(FAISS_NUM_THREADS)
+
+# How long get_embedding_stats reuses the index file size
+INDEX_STAT_TTL_SECONDS = float(os.getenv("INDEX_STAT_TTL_SECONDS", "5"))
+
+# Search query cache: sha256 of the normalized query -> (normalized (1, d) vector, monotonic expiry)
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "4096"))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+_query_embedding_cache: "OrderedDict[str, Tuple[np.ndarray, float]]" = OrderedDict()
+
+def _new_index():
+    """Empty index keyed by chunk ID, so vectors can be removed without renumbering the rest"""
+    return faiss.IndexIDMap2(_new_base_index())
+
+def _new_base_index():
+    """Empty inner-product index of the configured FAISS_INDEX_TYPE"""
+    if FAISS_INDEX_TYPE == "hnsw":
+        index = faiss.IndexHNSWFlat(EMBEDDING_DIMENSION, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+        return index
+    if FAISS_INDEX_TYPE == "hnsw_sq":
+        index = faiss.IndexHNSWSQ(
+            EMBEDDING_DIMENSION, faiss.ScalarQuantizer.QT_8bit, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION
+        return index
+    if FAISS_INDEX_TYPE == "ivf_pq":
+        return faiss.index_factory(
+            EMBEDDING_DIMENSION, f"IVF{FAISS_IVF_NLIST},PQ{FAISS_PQ_M}", faiss.METRIC_INNER_PRODUCT
+        )
+    if FAISS_INDEX_TYPE == "sq":
+        return faiss.IndexScalarQuantizer(
+            EMBEDDING_DIMENSION, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+    if FAISS_INDEX_TYPE != "flat":
+        logger.warning(f"Unknown FAISS_INDEX_TYPE '{FAISS_INDEX_TYPE}', using flat")
+    return faiss.IndexFlatIP(EMBEDDING_DIMENSION)
+
+def _base_index(index):
+    """The index an IndexIDMap2 wraps, or the index itself"""
+    return faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+
+def _trains_on_batch(index) -> bool:
+    """True for an IVF index that still needs a training sample before it can take vectors"""
+    return hasattr(_base_index(index), "nlist") and not index.is_trained
+
+def _add_to_index(index, vectors: np.ndarray, ids: np.ndarray):
+    """Add normalized vectors under their chunk IDs, training quantized indexes on their first batch"""
+    if not index.is_trained:
+        index.train(vectors)
+    index.add_with_ids(vectors, ids)
+
+def _compacted_index(index, live_ids: np.ndarray):
+    """A new index holding only the vectors of index whose chunk IDs are in live_ids"""
+    base = _base_index(index)
+    vectors = base.reconstruct_n(0, base.ntotal)
+    ids = faiss.vector_to_array(index.id_map)
+    keep = np.isin(ids, live_ids)
+    compacted = _new_index()
+    if keep.any():
+        _add_to_index(compacted, vectors[keep], ids[keep])
+    return compacted
+
+def _normalize_inplace(x: np.ndarray):
+    """L2-normalize rows in place with numpy; cheaper than faiss.normalize_L2 for a single query"""
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    np.divide(x, norms, out=x, where=norms > 0)
+
+def _bytes_per_vector(index) -> Optional[int]:
+    """Stored code size of one vector, excluding graph links"""
+    index = _base_index(index)
+    storage = faiss.downcast_index(index.storage) if hasattr(index, "storage") else index
+    return getattr(storage, "code_size", None)
+
 azure_openai_client = AsyncAzureOpenAI(
     api_key=AZURE_OPENAI_API_KEY,
     api_version=AZURE_OPENAI_API_VERSION,
     azure_endpoint=AZURE_OPENAI_ENDPOINT
 )
 
+class ChunkMetadata:
+    """Chunk metadata for every FAISS id, stored column-wise
+
+    The FAISS id of each vector is its chunk ID; row_of() finds its row. Numbers live in numpy arrays and
+    filename/team/project are codes into one shared string table, so a million
+    chunks cost tens of megabytes instead of a million dicts.
+    """
+
+    # Row layout accepted by extend(), matching get_chunk_metadata()
+    _INT_COLUMNS = (("chunk_id", np.int64), ("document_id", np.int64),
+                    ("chunk_index", np.int32), ("page_number", np.int32))
+    _STRING_COLUMNS = ("filename", "team", "project")
+
+    def __init__(self):
+        self._size = 0
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in self._INT_COLUMNS}
+        self._columns.update({name: np.empty(0, dtype=np.int32) for name in self._STRING_COLUMNS})
+        self.strings: List[str] = []
+        self._string_codes: Dict[str, int] = {}
+        # chunk_id -> row, built on first lookup
+        self._rows: Optional[Dict[int, int]] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def column(self, name: str) -> np.ndarray:
+        """View of one column over the filled rows"""
+        return self._columns[name][:self._size]
+
+    @property
+    def chunk_ids(self) -> np.ndarray:
+        return self.column("chunk_id")
+
+    def _code(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        code = self._string_codes.get(value)
+        if code is None:
+            code = self._string_codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def _reserve(self, extra: int):
+        """Grow every column geometrically so appends stay amortized O(1)"""
+        needed = self._size + extra
+        capacity = len(self._columns["chunk_id"])
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+
+    def extend(self, rows: List[Tuple]):
+        """Append (chunk_id, document_id, chunk_index, page_number, filename, team, project) rows"""
+        if not rows:
+            return
+        self._reserve(len(rows))
+        start, end = self._size, self._size + len(rows)
+        for position, (name, _) in enumerate(self._INT_COLUMNS):
+            self._columns[name][start:end] = [-1 if row[position] is None else row[position] for row in rows]
+        for position, name in enumerate(self._STRING_COLUMNS, start=len(self._INT_COLUMNS)):
+            self._columns[name][start:end] = [self._code(row[position]) for row in rows]
+        if self._rows is not None:
+            self._rows.update(zip((row[0] for row in rows), range(start, end)))
+        self._size = end
+
+    def row_of(self, chunk_id: int) -> Optional[int]:
+        """Row holding chunk_id, or None if it isn't indexed"""
+        if self._rows is None:
+            self._rows = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids.tolist())}
+        return self._rows.get(chunk_id)
+
+    def remove(self, chunk_ids: np.ndarray) -> int:
+        """Drop the rows of the given chunk IDs and return how many were removed"""
+        keep = ~np.isin(self.chunk_ids, chunk_ids)
+        removed = self._size - int(keep.sum())
+        if removed:
+            for name in self._columns:
+                self._columns[name] = self.column(name)[keep]
+            self._size -= removed
+            self._rows = None
+        return removed
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        """One row as the dict shape callers used before the columnar layout"""
+        if not 0 <= idx < self._size:
+            raise IndexError(idx)
+        row = {name: int(self._columns[name][idx]) for name, _ in self._INT_COLUMNS}
+        if row["page_number"] < 0:
+            row["page_number"] = None
+        for name in self._STRING_COLUMNS:
+            code = self._columns[name][idx]
+            row[name] = self.strings[code] if code >= 0 else None
+        return row
+
+    def __iter__(self):
+        for idx in range(self._size):
+            yield self[idx]
+
+    def save(self, path: str):
+        """Write the columns to an .npz file, replacing any previous one atomically"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                version=np.int32(METADATA_CACHE_VERSION),
+                strings=np.array(self.strings, dtype=np.str_),
+                **{name: self.column(name) for name in self._columns}
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["ChunkMetadata"]:
+        """Read columns written by save(); None if the file is missing or from another version"""
+        try:
+            data = np.load(path)
+        except FileNotFoundError:
+            return None
+        with data:
+            if "version" not in data or int(data["version"]) != METADATA_CACHE_VERSION:
+                return None
+            metadata = cls()
+            metadata.strings = data["strings"].tolist()
+            metadata._string_codes = {value: code for code, value in enumerate(metadata.strings)}
+            for name in metadata._columns:
+                metadata._columns[name] = data[name].astype(metadata._columns[name].dtype, copy=False)
+            metadata._size = len(metadata._columns["chunk_id"])
+        return metadata
+
 class EmbeddingManager:
+    """The FAISS index and its chunk metadata
+
+    Searches run on the event loop using FAISS_NUM_THREADS OpenMP threads each. On a small
+    index, concurrent requests already keep the cores busy, so a low count avoids threads
+    competing for memory bandwidth. Above SEARCH_BATCH_MIN_VECTORS, concurrent queries share
+    one batched search, where FAISS_NUM_THREADS=1 is usually the better choice.
+
+    Changes to the index and document_metadata happen under _write_lock, so concurrent
+    uploads, reindex and cleanup keep vectors and metadata in step. Searches take no lock:
+    add and search are blocking calls on the event loop thread and never overlap. If index
+    work is ever moved to worker threads, searches will need the lock too, except on HNSW
+    indexes that only ever have vectors added. Compaction builds its replacement index in a
+    worker thread but only reads the live one, then swaps it in on the event loop.
+    """
+
     def __init__(self):
         self.index = None
-        self.document_metadata = []
+        # With FAISS_MMAP the loaded index is read-only; new vectors wait here until save_index
+        self.pending = None
+        self.is_mmapped = False
+        self.document_metadata = ChunkMetadata()
         self.is_loaded = False
+        # Documents added since the last save_index, and the delayed save covering them
+        self._dirty = False
+        self._unsaved_docs = 0
+        self._save_task = None
+        self._compact_task = None
+        self._index_file_size = None
+        self._index_stat_expires = 0.0
+        # (query vector, k, future) waiting for the search batcher
+        self._search_queue = None
+        self._search_task = None
+        self._write_lock = asyncio.Lock()
+        self._load_lock = asyncio.Lock()
 
     async def load_index(self):
+        """Load the index once, however many requests arrive before it is ready"""
+        async with self._load_lock:
+            if not self.is_loaded:
+                await self._load_index()
+
+    async def _load_index(self):
         try:
-            if os.path.exists(FAISS_INDEX_PATH):
-                logger.info(f"Loading FAISS index from {FAISS_INDEX_PATH}...")
-                self.index = faiss.read_index(FAISS_INDEX_PATH)
-                logger.info(f"Loaded FAISS index with {self.index.ntotal} vectors")
+            try:
+                self._read_index()
+            except (RuntimeError, OSError) as e:
+                # FAISS reports a missing file as RuntimeError
+                logger.info(f"Could not read FAISS index from {FAISS_INDEX_PATH}: {str(e)}")
+                self.index = None
+            if self.index is not None and not hasattr(self.index, "id_map"):
+                # Indexes saved before vectors were keyed by chunk ID; rebuild from the stored embeddings
+                logger.info("Saved FAISS index uses positional ids, rebuilding it keyed by chunk ID...")
+                await reindex_all_documents()
+            elif self.index is not None:
+                if (FAISS_INDEX_TYPE == "ivf_pq" and not self.is_mmapped
+                        and isinstance(_base_index(self.index), faiss.IndexFlat)):
+                    # Saved while IVF training was still waiting for enough vectors
+                    self.pending = self.index
+                    self.index = _new_index()
+                logger.info(f"Loaded FAISS index from {FAISS_INDEX_PATH} with {self.ntotal} vectors")
+
+                # Metadata saved alongside the index skips the SQL rebuild
+                metadata = ChunkMetadata.load(FAISS_METADATA_PATH)
+                if metadata is not None and len(metadata) == self.ntotal:
+                    self.document_metadata = metadata
+                    logger.info(f"Loaded {len(metadata)} chunk metadata records from {FAISS_METADATA_PATH}")
+                    await self._recover_unsaved()
+                else:
+                    await self.load_metadata()
+                    if len(self.document_metadata) == self.ntotal:
+                        self._save_metadata()
             else:
                 logger.info("No existing FAISS index found. Creating new index...")
-                self.index = faiss.IndexFlatIP(EMBEDDING_DIMENSION)
-            await self.load_metadata()
+                self.reset_index()
+                await self.load_metadata()
+            if self.dead_vectors:
+                # Deletes from before a restart that were never compacted
+                self.schedule_compaction()
             self.is_loaded = True
         except Exception as e:
             logger.error(f"Error loading FAISS index: {str(e)}")
-            self.index = faiss.IndexFlatIP(EMBEDDING_DIMENSION)
-            self.document_metadata = []
+            self.reset_index()
+            self.document_metadata = ChunkMetadata()
+
+    def _read_index(self):
+        """Read the saved index, memory-mapped and read-only when FAISS_MMAP is set"""
+        if FAISS_MMAP:
+            self.index = faiss.read_index(FAISS_INDEX_PATH, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        else:
+            self.index = faiss.read_index(FAISS_INDEX_PATH)
+        self.is_mmapped = FAISS_MMAP
+        self.pending = None
+
+    def index_file_size(self) -> Optional[int]:
+        """Size of the saved index file in bytes, or None if there is none; re-stat at most every INDEX_STAT_TTL_SECONDS"""
+        now = time.monotonic()
+        if now >= self._index_stat_expires:
+            try:
+                self._index_file_size = os.stat(FAISS_INDEX_PATH).st_size
+            except FileNotFoundError:
+                self._index_file_size = None
+            self._index_stat_expires = now + INDEX_STAT_TTL_SECONDS
+        return self._index_file_size
+
+    def reset_index(self):
+        """Start over with an empty in-memory index"""
+        self.index = _new_index()
+        self.is_mmapped = False
+        self.pending = None
+
+    @property
+    def ntotal(self) -> int:
+        """Vectors searchable right now, including ones not yet saved"""
+        if self.index is None:
+            return 0
+        return self.index.ntotal + (self.pending.ntotal if self.pending is not None else 0)
+
+    @property
+    def dead_vectors(self) -> int:
+        """Vectors still in the index whose chunks were dropped from document_metadata"""
+        return max(0, self.ntotal - len(self.document_metadata))
+
+    @property
+    def is_quantized(self) -> bool:
+        """Whether the index stores compressed codes rather than float32 vectors"""
+        if self.index is None:
+            return False
+        bytes_per_vector = _bytes_per_vector(self.index)
+        return bytes_per_vector is not None and bytes_per_vector < EMBEDDING_DIMENSION * 4
+
+    @property
+    def is_staging(self) -> bool:
+        """New vectors wait in pending until the IVF index has enough to train on"""
+        return not self.is_mmapped and _trains_on_batch(self.index)
+
+    def add_vectors(self, vectors: np.ndarray, chunk_ids: np.ndarray):
+        """Add normalized vectors under their chunk IDs"""
+        if not self.is_mmapped and not self.is_staging:
+            _add_to_index(self.index, vectors, chunk_ids)
+            return
+        if self.pending is None:
+            self.pending = faiss.IndexIDMap2(faiss.IndexFlatIP(EMBEDDING_DIMENSION))
+        self.pending.add_with_ids(vectors, chunk_ids)
+        if self.is_staging and self.pending.ntotal >= FAISS_IVF_TRAIN_SIZE:
+            self._train_from_pending()
+
+    def _pending_contents(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(vectors, chunk IDs) held in pending"""
+        vectors = faiss.downcast_index(self.pending.index).reconstruct_n(0, self.pending.ntotal)
+        return vectors, faiss.vector_to_array(self.pending.id_map)
+
+    def _train_from_pending(self):
+        """Train the IVF index on the staged vectors and move them into it"""
+        vectors, chunk_ids = self._pending_contents()
+        _add_to_index(self.index, vectors, chunk_ids)
+        self.pending = None
+        logger.info(f"Trained {type(_base_index(self.index)).__name__} on {len(chunk_ids)} vectors")
+
+    def remove_vectors(self, chunk_ids: np.ndarray) -> int:
+        """Remove chunks from the index and metadata; raises RuntimeError if the index type can't remove"""
+        if self.is_mmapped:
+            raise RuntimeError("memory-mapped index is read-only")
+        self.index.remove_ids(chunk_ids)
+        if self.pending is not None:
+            self.pending.remove_ids(chunk_ids)
+        removed = self.document_metadata.remove(chunk_ids)
+        self._dirty = True
+        return removed
+
+    def schedule_compaction(self):
+        """Compact the index FAISS_COMPACT_DELAY_SECONDS from now, once for a burst of deletes"""
+        if self._compact_task is None or self._compact_task.done():
+            self._compact_task = asyncio.create_task(self._compact_after_delay())
+
+    async def _compact_after_delay(self):
+        # Deletes that land while compacting find this task still running, so go round again
+        while True:
+            await asyncio.sleep(FAISS_COMPACT_DELAY_SECONDS)
+            await self.compact()
+            if not self.dead_vectors:
+                break
+
+    async def compact(self):
+        """Rebuild the index without the vectors of chunks no longer in document_metadata"""
+        try:
+            if self.is_mmapped or self.pending is not None:
+                # The mapped index is read-only; rebuild from the stored embeddings instead
+                if self.dead_vectors:
+                    await reindex_all_documents()
+                return
+            async with self._write_lock:
+                dead = self.dead_vectors
+                if not dead:
+                    return
+                self.index = await asyncio.get_running_loop().run_in_executor(
+                    None, _compacted_index, self.index, self.document_metadata.chunk_ids
+                )
+                self._dirty = True
+            await self.save_index()
+            logger.info(f"Compacted FAISS index, dropped {dead} dead vectors")
+        except Exception as e:
+            logger.error(f"Error compacting FAISS index: {str(e)}")
+
+    def search(self, query_vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k over the index and any pending vectors, as FAISS (scores, chunk IDs) arrays"""
+        if self.index.ntotal == 0 and self.pending is not None:
+            return self.pending.search(query_vectors, k)
+        base = _base_index(self.index)
+        if hasattr(base, "hnsw"):
+            # efSearch must cover k or HNSW returns fewer than k results
+            base.hnsw.efSearch = max(FAISS_HNSW_EF_SEARCH, k)
+        if hasattr(base, "nprobe"):
+            base.nprobe = FAISS_IVF_NPROBE
+        scores, ids = self.index.search(query_vectors, k)
+        if self.pending is None or self.pending.ntotal == 0:
+            return scores, ids
+
+        pending_scores, pending_ids = self.pending.search(query_vectors, k)
+        all_scores = np.concatenate([scores, pending_scores], axis=1)
+        all_ids = np.concatenate([ids, pending_ids], axis=1)
+        # FAISS pads missing results with id -1 and a -inf-like score, so they sort last
+        order = np.argsort(-all_scores, axis=1)[:, :k]
+        return np.take_along_axis(all_scores, order, axis=1), np.take_along_axis(all_ids, order, axis=1)
+
+    async def search_batched(self, query_vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """search() for one (1, d) query, sharing an index.search call with concurrent queries on large indexes"""
+        if self.ntotal < SEARCH_BATCH_MIN_VECTORS:
+            return self.search(query_vector, k)
+        if self._search_queue is None:
+            self._search_queue = asyncio.Queue()
+        if self._search_task is None or self._search_task.done():
+            self._search_task = asyncio.create_task(self._run_search_batcher())
+        future = asyncio.get_running_loop().create_future()
+        self._search_queue.put_nowait((query_vector, k, future))
+        return await future
+
+    async def _run_search_batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._search_queue.get()]
+            deadline = loop.time() + SEARCH_BATCH_WINDOW_MS / 1000
+            while len(batch) < SEARCH_BATCH_MAX_QUERIES:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._search_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Search once with the largest k; each caller gets its own row cut to its k
+            try:
+                scores, ids = self.search(np.vstack([query for query, _, _ in batch]), max(k for _, k, _ in batch))
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for row, (_, k, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result((scores[row:row + 1, :k], ids[row:row + 1, :k]))
 
     async def load_metadata(self):
         try:
             logger.info("Loading document chunk metadata from database...")
-            # FIXED: Properly await the connection and close it
-            conn = await get_db_connection()
-            cursor = await conn.execute("""
-                SELECT dc.id, dc.document_id, dc.chunk_index, dc.page_number,
-                       d.filename, d.team, d.project
-                FROM document_chunks dc
-                JOIN documents d ON dc.document_id = d.id
-                WHERE d.status = 'completed'
-                ORDER BY dc.document_id, dc.chunk_index
-            """)
-            rows = await cursor.fetchall()
-            await conn.close()
+            rows = await get_chunk_metadata()
             
-            self.document_metadata = []
-            for row in rows:
-                self.document_metadata.append({
-                    "chunk_id": row[0],
-                    "document_id": row[1],
-                    "chunk_index": row[2],
-                    "page_number": row[3],
-                    "filename": row[4],
-                    "team": row[5],
-                    "project": row[6]
-                })
+            metadata = ChunkMetadata()
+            metadata.extend(rows)
+            self.document_metadata = metadata
             logger.info(f"Loaded {len(self.document_metadata)} chunk metadata records")
         except Exception as e:
             logger.error(f"Error loading metadata: {str(e)}")
-            self.document_metadata = []
+            self.document_metadata = ChunkMetadata()
+
+    async def _recover_unsaved(self):
+        """Add chunks stored after the last save_index, e.g. when the process stopped before a delayed save"""
+        chunk_ids = self.document_metadata.chunk_ids
+        rows = await get_chunks_after(int(chunk_ids.max()) if len(chunk_ids) else 0)
+        if not rows:
+            return
+        embeddings_array = np.stack([blob_to_embedding(row[7]) for row in rows])
+        faiss.normalize_L2(embeddings_array)
+        async with self._write_lock:
+            self.add_vectors(embeddings_array, np.array([row[0] for row in rows], dtype=np.int64))
+            self.document_metadata.extend([row[:7] for row in rows])
+        logger.info(f"Recovered {len(rows)} vectors added after the last index save")
+        await self.save_index()
+
+    async def add_document(self, vectors: np.ndarray, chunk_ids: np.ndarray, metadata_rows: List[Tuple]):
+        """Add one document's vectors and metadata together, then schedule a save"""
+        async with self._write_lock:
+            self.add_vectors(vectors, chunk_ids)
+            self.document_metadata.extend(metadata_rows)
+        await self.mark_dirty()
+
+    async def mark_dirty(self):
+        """Note an added document; save now every FAISS_SAVE_EVERY_DOCS documents, otherwise after a delay"""
+        self._dirty = True
+        self._unsaved_docs += 1
+        if self._unsaved_docs >= FAISS_SAVE_EVERY_DOCS:
+            await self.save_index()
+        elif self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_after_delay())
+
+    async def _save_after_delay(self):
+        await asyncio.sleep(FAISS_SAVE_DELAY_SECONDS)
+        if self._dirty:
+            await self.save_index()
+
+    async def flush(self):
+        """Save any unsaved additions immediately, e.g. on shutdown"""
+        if self._save_task is not None and not self._save_task.done():
+            self._save_task.cancel()
+        self._save_task = None
+        if self._dirty:
+            await self.save_index()
+
+    def _save_metadata(self):
+        """Persist document_metadata next to the index file"""
+        try:
+            self.document_metadata.save(FAISS_METADATA_PATH)
+        except Exception as e:
+            logger.error(f"Error saving chunk metadata: {str(e)}")
 
     async def save_index(self):
+        async with self._write_lock:
+            self._save_index()
+
+    def _save_index(self):
         try:
-            if self.index:
-                faiss.write_index(self.index, FAISS_INDEX_PATH)
+            if self.is_mmapped:
+                if self.pending is None or self.pending.ntotal == 0:
+                    self._dirty = False
+                    self._unsaved_docs = 0
+                    return
+                # The mapped index can't be modified: merge into a full copy, write it and remap
+                full = faiss.read_index(FAISS_INDEX_PATH)
+                _add_to_index(full, *self._pending_contents())
+                faiss.write_index(full, FAISS_INDEX_PATH)
+                del full
+                self._read_index()
+                self._save_metadata()
+                logger.info(f"Merged pending vectors and saved FAISS index to {FAISS_INDEX_PATH}")
+            elif self.index:
+                # Until the IVF index is trained, the staged exact index is what gets saved
+                staged = self.is_staging and self.pending is not None
+                faiss.write_index(self.pending if staged else self.index, FAISS_INDEX_PATH)
+                self._save_metadata()
                 logger.info(f"Saved FAISS index to {FAISS_INDEX_PATH}")
+            self._dirty = False
+            self._unsaved_docs = 0
+            self._index_stat_expires = 0.0
         except Exception as e:
             logger.error(f"Error saving FAISS index: {str(e)}")
 
@@ -111,7 +673,68 @@ async def generate_embedding(text: str) -> List[float]:
         logger.error(f"Error generating embedding: {str(e)}")
         raise
 
-async def process_document(filename: str, text_content: str, team: str, project: str) -> int:
+async def get_query_vector(query: str) -> np.ndarray:
+    """Normalized (1, d) search vector for a query, reusing recent embeddings of the same query"""
+    key = hashlib.sha256(query.strip().lower().encode("utf-8")).hexdigest()
+    entry = _query_embedding_cache.get(key)
+    if entry is not None:
+        vector, expires_at = entry
+        if expires_at > time.monotonic():
+            _query_embedding_cache.move_to_end(key)
+            return vector
+        del _query_embedding_cache[key]
+
+    vector = np.array([await generate_embedding(query)], dtype=np.float32)
+    _normalize_inplace(vector)
+    # Shared between callers, so it must not be modified in place
+    vector.flags.writeable = False
+    _query_embedding_cache[key] = (vector, time.monotonic() + QUERY_EMBEDDING_CACHE_TTL_SECONDS)
+    while len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_MAX_ENTRIES:
+        _query_embedding_cache.popitem(last=False)
+    return vector
+
+async def _embed_group(texts: List[str]) -> List[List[float]]:
+    """Embed a list of texts in one request, limited to MAX_CONCURRENT_EMBEDDINGS requests in flight"""
+    async with _embedding_semaphore:
+        response = await azure_openai_client.embeddings.create(
+            input=texts,
+            model=EMBEDDING_DEPLOYMENT
+        )
+    # data is documented to follow input order, but index is authoritative
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+async def generate_embeddings_batch(texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """Embed many texts with batched requests into one float32 array; the mask is False for rows of a failed request"""
+    # Group texts of similar length together, remembering where each came from
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    groups = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+    results = await asyncio.gather(
+        *[_embed_group([texts[i] for i in group]) for group in groups],
+        return_exceptions=True
+    )
+
+    # Each embedding is copied once, straight into its row
+    embeddings = np.empty((len(texts), EMBEDDING_DIMENSION), dtype=np.float32)
+    embedded = np.zeros(len(texts), dtype=bool)
+    for group, result in zip(groups, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Error generating embeddings for {len(group)} texts: {str(result)}")
+            continue
+        for i, embedding in zip(group, result):
+            embeddings[i] = embedding
+        embedded[group] = True
+    return embeddings, embedded
+
+def _utf8_size(text: str, block: int = 65536) -> int:
+    """UTF-8 byte length of text, encoding one block at a time instead of copying the whole string"""
+    if text.isascii():
+        return len(text)
+    return sum(len(text[start:start + block].encode('utf-8', 'surrogatepass')) for start in range(0, len(text), block))
+
+async def process_document(filename: str, text_content: str, team: str, project: str,
+                           file_size: Optional[int] = None) -> int:
+    """Store, chunk and index a document; file_size defaults to the UTF-8 size of text_content"""
     try:
         if not embedding_manager.is_loaded:
             await embedding_manager.load_index()
@@ -124,7 +747,7 @@ async def process_document(filename: str, text_content: str, team: str, project:
             team=team,
             project=project,
             file_type=filename.split('.')[-1].lower(),
-            file_size=len(text_content.encode('utf-8')),
+            file_size=file_size if file_size is not None else _utf8_size(text_content),
             file_path=get_file_path(filename, team, project)
         )
         logger.info(f"Document ID {document_id} created, updating status to processing")
@@ -138,38 +761,31 @@ async def process_document(filename: str, text_content: str, team: str, project:
             await update_document_status(document_id, "error")
             return document_id
 
-        embeddings = []
-        chunk_metadata = []
+        # Embed all chunks with batched requests; results come back in chunk order
+        embeddings_array, embedded = await generate_embeddings_batch(chunks)
+
+        chunk_rows = []
         for i, chunk in enumerate(chunks):
-            try:
-                embedding = await generate_embedding(chunk)
-                embeddings.append(embedding)
-                chunk_id = await insert_document_chunk(
-                    document_id=document_id,
-                    chunk_index=i,
-                    chunk_text=chunk,
-                    embedding_vector=json.dumps(embedding)
-                )
-                chunk_metadata.append({
-                    "chunk_id": chunk_id,
-                    "document_id": document_id,
-                    "chunk_index": i,
-                    "filename": filename,
-                    "team": team,
-                    "project": project
-                })
-                logger.info(f"Processed chunk {i+1}/{len(chunks)} for document ID {document_id}")
-            except Exception as e:
-                logger.error(f"Error processing chunk {i} for document ID {document_id}: {str(e)}")
+            if not embedded[i]:
+                logger.error(f"Error processing chunk {i} for document ID {document_id}")
                 continue
+            chunk_rows.append((i, chunk, embedding_to_blob(embeddings_array[i]), None))
+        logger.info(f"Embedded {len(chunk_rows)}/{len(chunks)} chunks for document ID {document_id}")
+
+        # Store all chunks for the document in a single transaction
+        chunk_ids = await insert_document_chunks(document_id, chunk_rows)
+        chunk_metadata = [
+            (chunk_id, document_id, chunk_index, page_number, filename, team, project)
+            for chunk_id, (chunk_index, _, _, page_number) in zip(chunk_ids, chunk_rows)
+        ]
 
-        if embeddings:
-            embeddings_array = np.array(embeddings, dtype=np.float32)
+        if chunk_rows:
+            # Blobs above keep the raw vectors; normalize in place unless rows have to be dropped
+            if len(chunk_rows) < len(chunks):
+                embeddings_array = embeddings_array[embedded]
             faiss.normalize_L2(embeddings_array)
-            embedding_manager.index.add(embeddings_array)
-            embedding_manager.document_metadata.extend(chunk_metadata)
-            await embedding_manager.save_index()
-            logger.info(f"Added {len(embeddings)} embeddings to FAISS index")
+            await embedding_manager.add_document(embeddings_array, np.array(chunk_ids, dtype=np.int64), chunk_metadata)
+            logger.info(f"Added {len(chunk_rows)} embeddings to FAISS index")
 
         await update_document_status(document_id, "completed", len(chunks))
         logger.info(f"Completed processing document '{filename}' with ID {document_id}")
@@ -181,132 +797,178 @@ async def process_document(filename: str, text_content: str, team: str, project:
             await update_document_status(document_id, "error")
         raise
 
-async def search_similar_documents(query: str, limit: int = 5) -> List[Dict[str, Any]]:
+async def _rerank_exact(query_vector: np.ndarray, hits: List[Tuple[float, Dict[str, Any]]],
+                        limit: int) -> List[Tuple[float, Dict[str, Any]]]:
+    """Rescore quantized-index hits by cosine similarity against the stored float32 embeddings"""
+    try:
+        stored = await get_chunk_embeddings([metadata["chunk_id"] for _, metadata in hits])
+    except Exception as e:
+        logger.error(f"Error loading embeddings for reranking: {str(e)}")
+        return hits[:limit]
+
+    rescored = []
+    for score, metadata in hits:
+        embedding = stored.get(metadata["chunk_id"])
+        if embedding is not None:
+            norm = np.linalg.norm(embedding)
+            if norm > 0:
+                score = float(embedding @ query_vector[0] / norm)
+        rescored.append((score, metadata))
+    rescored.sort(key=lambda hit: hit[0], reverse=True)
+    return rescored[:limit]
+
+async def search_similar_documents(query: str, limit: int = 5,
+                                   query_vector: Optional[np.ndarray] = None,
+                                   raise_errors: bool = False) -> List[Dict[str, Any]]:
+    """Chunks most similar to query; pass query_vector when the caller already has it
+
+    Errors are logged and give no results, unless raise_errors is set.
+    """
     try:
         logger.info(f"Searching for similar documents with query: '{query}'")
         
         if not embedding_manager.is_loaded:
             await embedding_manager.load_index()
         
-        if embedding_manager.index.ntotal == 0:
+        if embedding_manager.ntotal == 0:
             logger.warning("No vectors in FAISS index")
             return []
         
-        query_embedding = await generate_embedding(query)
-        query_vector = np.array([query_embedding], dtype=np.float32)
-        faiss.normalize_L2(query_vector)
+        if query_vector is None:
+            query_vector = await get_query_vector(query)
         
-        scores, indices = embedding_manager.index.search(query_vector, limit)
+        quantized = embedding_manager.is_quantized
+        candidates = max(limit, FAISS_RERANK_CANDIDATES) if quantized else limit
+        # Deleted chunks not yet compacted out of an HNSW index still take top-k slots
+        candidates += embedding_manager.dead_vectors
+        scores, indices = await embedding_manager.search_batched(query_vector, candidates)
+
+        # FAISS ids are chunk IDs; approximate indexes pad missing results with -1
+        metadata_table = embedding_manager.document_metadata
+        hits = []
+        for score, chunk_id in zip(scores[0], indices[0]):
+            row = metadata_table.row_of(int(chunk_id))
+            if row is not None:
+                hits.append((float(score), metadata_table[row]))
+        if quantized:
+            hits = await _rerank_exact(query_vector, hits, limit)
+        else:
+            hits = hits[:limit]
+        # One query for every hit's text instead of one per result
+        chunks = await get_chunks_by_ids([metadata["chunk_id"] for _, metadata in hits])
+
         results = []
-        
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < len(embedding_manager.document_metadata):
-                metadata = embedding_manager.document_metadata[idx]
-                # FIXED: Properly await the connection and close it
-                conn = await get_db_connection()
-                cursor = await conn.execute("""
-                    SELECT chunk_text, page_number FROM document_chunks
-                    WHERE id = ?
-                """, (metadata["chunk_id"],))
-                chunk_data = await cursor.fetchone()
-                await conn.close()
-                
-                if chunk_data:
-                    result = {
-                        "document_id": metadata["document_id"],
-                        "filename": metadata["filename"],
-                        "team": metadata["team"],
-                        "project": metadata["project"],
-                        "chunk_text": chunk_data[0],
-                        "page_number": chunk_data[1],
-                        "similarity_score": float(score),
-                        "chunk_index": metadata["chunk_index"]
-                    }
-                    results.append(result)
-                    logger.info(f"Found match: {metadata['filename']} (score: {score:.3f})")
+        for score, metadata in hits:
+            chunk_data = chunks.get(metadata["chunk_id"])
+            if chunk_data:
+                result = {
+                    "document_id": metadata["document_id"],
+                    "filename": metadata["filename"],
+                    "team": metadata["team"],
+                    "project": metadata["project"],
+                    "chunk_text": chunk_data[0],
+                    "page_number": chunk_data[1],
+                    "similarity_score": score,
+                    "chunk_index": metadata["chunk_index"]
+                }
+                results.append(result)
+                logger.info(f"Found match: {metadata['filename']} (score: {score:.3f})")
         
         logger.info(f"Found {len(results)} similar documents for query: '{query}'")
         return results
         
     except Exception as e:
         logger.error(f"Error searching documents for query '{query}': {str(e)}")
+        if raise_errors:
+            raise
         return []
 
-async def reindex_all_documents():
-    """Reindex all documents in the database"""
+async def _reindex_one_document(doc, reembed: bool) -> Tuple[Optional[np.ndarray], List[Tuple]]:
+    """Normalized vectors and metadata for one document's chunks, regenerating missing embeddings"""
+    doc_id, filename, team, project = doc
+    
+    # Get chunks for this document
+    chunks = await get_chunks_for_reindex(doc_id)
+    
+    # Reuse stored vectors; only chunks without one go back to Azure OpenAI
+    embeddings_array = np.empty((len(chunks), EMBEDDING_DIMENSION), dtype=np.float32)
+    embedded = np.zeros(len(chunks), dtype=bool)
+    missing = []
+    for i, row in enumerate(chunks):
+        stored = None if reembed else blob_to_embedding(row[3])
+        if stored is None:
+            missing.append(i)
+        else:
+            embeddings_array[i] = stored
+            embedded[i] = True
+
+    updates = []
+    if missing:
+        generated, generated_ok = await generate_embeddings_batch(
+            [decompress_chunk_text(chunks[i][0]) for i in missing]
+        )
+        for j, i in enumerate(missing):
+            if generated_ok[j]:
+                embeddings_array[i] = generated[j]
+                embedded[i] = True
+                updates.append((embedding_to_blob(generated[j]), chunks[i][2]))
+
+    metadata = []
+    for i, (chunk_text, chunk_index, chunk_id, _) in enumerate(chunks):
+        if not embedded[i]:
+            logger.error(f"Error reindexing chunk {chunk_id}: no embedding returned")
+            continue
+        metadata.append((chunk_id, doc_id, chunk_index, None, filename, team, project))
+    
+    # Store newly generated embeddings for the document in one transaction
+    if updates:
+        try:
+            await update_chunk_embeddings(updates)
+        except Exception as e:
+            logger.error(f"Error storing embeddings for document {doc_id}: {str(e)}")
+
+    if not metadata:
+        return None, metadata
+    if len(metadata) < len(chunks):
+        embeddings_array = embeddings_array[embedded]
+    faiss.normalize_L2(embeddings_array)
+    return embeddings_array, metadata
+
+async def reindex_all_documents(reembed: bool = False):
+    """Rebuild the FAISS index from the database, embedding only chunks without a stored vector unless reembed"""
     try:
         logger.info("Starting reindex of all documents...")
         
-        # Clear existing index
-        embedding_manager.index = faiss.IndexFlatIP(EMBEDDING_DIMENSION)
-        embedding_manager.document_metadata = []
-        
         # Get all processed documents
-        conn = await get_db_connection()
-        cursor = await conn.execute("""
-            SELECT id, filename, team, project FROM documents 
-            WHERE status = 'completed'
-        """)
-        documents = await cursor.fetchall()
-        await conn.close()
+        documents = await get_completed_documents()
         
         logger.info(f"Found {len(documents)} completed documents to reindex")
         
-        # Process each document
-        for doc in documents:
-            doc_id, filename, team, project = doc
-            
-            # Get chunks for this document
-            conn = await get_db_connection()
-            cursor = await conn.execute("""
-                SELECT chunk_text, chunk_index, id FROM document_chunks
-                WHERE document_id = ?
-                ORDER BY chunk_index
-            """, (doc_id,))
-            chunks = await cursor.fetchall()
-            await conn.close()
-            
-            # Generate embeddings for chunks
-            embeddings = []
-            for chunk_text, chunk_index, chunk_id in chunks:
-                try:
-                    embedding = await generate_embedding(chunk_text)
-                    embeddings.append(embedding)
-                    
-                    # Update embedding in database
-                    conn = await get_db_connection()
-                    await conn.execute("""
-                        UPDATE document_chunks 
-                        SET embedding_vector = ?
-                        WHERE id = ?
-                    """, (json.dumps(embedding), chunk_id))
-                    await conn.commit()
-                    await conn.close()
-                    
-                    # Add to metadata
-                    embedding_manager.document_metadata.append({
-                        "chunk_id": chunk_id,
-                        "document_id": doc_id,
-                        "chunk_index": chunk_index,
-                        "filename": filename,
-                        "team": team,
-                        "project": project
-                    })
-                    
-                except Exception as e:
-                    logger.error(f"Error reindexing chunk {chunk_id}: {str(e)}")
+        # Prepare documents concurrently; embedding requests stay under MAX_CONCURRENT_EMBEDDINGS
+        semaphore = asyncio.Semaphore(REINDEX_MAX_CONCURRENT_DOCS)
+        
+        async def reindex_bounded(doc):
+            async with semaphore:
+                return await _reindex_one_document(doc, reembed)
+        
+        results = await asyncio.gather(*[reindex_bounded(doc) for doc in documents])
+        
+        # Swap in the new index only once everything is ready, keeping vectors and metadata aligned
+        async with embedding_manager._write_lock:
+            embedding_manager.reset_index()
+            embedding_manager.document_metadata = ChunkMetadata()
+            for doc, (embeddings_array, metadata) in zip(documents, results):
+                if embeddings_array is None:
                     continue
-            
-            # Add embeddings to FAISS
-            if embeddings:
-                embeddings_array = np.array(embeddings, dtype=np.float32)
-                faiss.normalize_L2(embeddings_array)
-                embedding_manager.index.add(embeddings_array)
-                logger.info(f"Reindexed {len(embeddings)} chunks for document {filename}")
+                embedding_manager.add_vectors(
+                    embeddings_array, np.fromiter((row[0] for row in metadata), dtype=np.int64, count=len(metadata))
+                )
+                embedding_manager.document_metadata.extend(metadata)
+                logger.info(f"Reindexed {len(metadata)} chunks for document {doc[1]}")
         
         # Save updated index
         await embedding_manager.save_index()
-        logger.info(f"Reindexing completed. Total vectors: {embedding_manager.index.ntotal}")
+        logger.info(f"Reindexing completed. Total vectors: {embedding_manager.ntotal}")
         
     except Exception as e:
         logger.error(f"Error during reindexing: {str(e)}")
@@ -317,44 +979,63 @@ async def get_embedding_stats() -> Dict[str, Any]:
     try:
         if not embedding_manager.is_loaded:
             await embedding_manager.load_index()
+        index_file_size = embedding_manager.index_file_size()
         return {
-            "total_embeddings": embedding_manager.index.ntotal if embedding_manager.index else 0,
-            "index_size_mb": os.path.getsize(FAISS_INDEX_PATH) / (1024*1024) if os.path.exists(FAISS_INDEX_PATH) else 0,
+            "total_embeddings": embedding_manager.ntotal,
+            "index_size_mb": index_file_size / (1024*1024) if index_file_size is not None else 0,
             "embedding_dimension": EMBEDDING_DIMENSION,
+            "index_type": type(_base_index(embedding_manager.index)).__name__ if embedding_manager.index else None,
+            # int8 indexes store 1 byte per dimension instead of 4, at a small recall cost
+            "bytes_per_vector": _bytes_per_vector(embedding_manager.index) if embedding_manager.index else None,
             "metadata_count": len(embedding_manager.document_metadata)
         }
     except Exception as e:
         logger.error(f"Error getting embedding stats: {str(e)}")
         return {}
 
+async def remove_document_embeddings(document_id: int):
+    """Drop a deleted document's vectors, or on HNSW its metadata until the index is compacted"""
+    try:
+        metadata_table = embedding_manager.document_metadata
+        chunk_ids = metadata_table.chunk_ids[metadata_table.column("document_id") == document_id]
+        if not len(chunk_ids):
+            return
+        async with embedding_manager._write_lock:
+            try:
+                removed = embedding_manager.remove_vectors(chunk_ids)
+            except RuntimeError:
+                # HNSW can't remove vectors; searches skip chunks without metadata until compaction
+                removed = embedding_manager.document_metadata.remove(chunk_ids)
+                embedding_manager.schedule_compaction()
+        await embedding_manager.mark_dirty()
+        logger.info(f"Removed {removed} vectors for deleted document {document_id}")
+    except Exception as e:
+        logger.error(f"Error removing embeddings for document {document_id}: {str(e)}")
+
 async def cleanup_embeddings():
     """Clean up orphaned embeddings and rebuild index if needed"""
     try:
         logger.info("Starting embedding cleanup...")
         
         # Get all chunk IDs from database
-        conn = await get_db_connection()
-        cursor = await conn.execute("""
-            SELECT dc.id FROM document_chunks dc
-            JOIN documents d ON dc.document_id = d.id
-            WHERE d.status = 'completed'
-        """)
-        valid_chunk_ids = {row[0] for row in await cursor.fetchall()}
-        await conn.close()
+        valid_chunk_ids = await get_completed_chunk_ids()
         
         # Check metadata for orphaned entries
-        valid_metadata = []
-        for metadata in embedding_manager.document_metadata:
-            if metadata["chunk_id"] in valid_chunk_ids:
-                valid_metadata.append(metadata)
-            else:
-                logger.info(f"Removing orphaned metadata for chunk {metadata['chunk_id']}")
+        chunk_ids = embedding_manager.document_metadata.chunk_ids
+        orphaned = chunk_ids[~np.isin(chunk_ids, np.fromiter(valid_chunk_ids, dtype=np.int64, count=len(valid_chunk_ids)))]
         
-        # If we found orphaned metadata, rebuild the index
-        if len(valid_metadata) != len(embedding_manager.document_metadata):
-            logger.info("Found orphaned metadata, rebuilding index...")
-            embedding_manager.document_metadata = valid_metadata
-            await reindex_all_documents()
+        # Remove orphans in place; compact instead when the index type can't remove vectors (HNSW)
+        if len(orphaned):
+            try:
+                async with embedding_manager._write_lock:
+                    removed = embedding_manager.remove_vectors(orphaned)
+                await embedding_manager.save_index()
+                logger.info(f"Removed {removed} orphaned chunks from the index")
+            except RuntimeError as e:
+                logger.info(f"Found {len(orphaned)} orphaned chunks, compacting index ({str(e)})...")
+                async with embedding_manager._write_lock:
+                    embedding_manager.document_metadata.remove(orphaned)
+                await embedding_manager.compact()
         else:
             logger.info("No orphaned metadata found")
             
@@ -3,36 +3,82 @@
 HelperGPT Main Application
 FastAPI backend for AI-powered internal documentation system
 """
-from fastapi import FastAPI, File, UploadFile, Depends, HTTPException, Form, status
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, ORJSONResponse, Response
 from typing import List, Optional, Any
 import os
 import logging
 import uvicorn
 from datetime import datetime
 import asyncio
+import orjson
 
 # Import our modules - Fixed imports for root-level structure
-from database import init_db, get_db_connection, get_document_by_id, delete_document_by_id
+from database import (
+    init_db, close_db, get_db_connection, get_document_by_id, get_documents_by_team_project, pop_document
+)
 from models import QuestionRequest, QuestionResponse, DocumentUpload, LoginRequest
-from auth import authenticate_admin, create_access_token, verify_token
+from auth import authenticate_admin, create_access_token, AdminAuthASGIMiddleware
 from storage import save_uploaded_file, get_file_path, delete_file
-from embeddings import process_document, search_similar_documents, get_embedding_stats
-from utils import extract_text_from_file, chunk_text, generate_response
+from embeddings import (
+    process_document, search_similar_documents, get_embedding_stats, get_query_vector, remove_document_embeddings
+)
+from semantic_cache import semantic_cache
+from utils import extract_text_from_file, chunk_text, generate_response, shutdown_extract_pool
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Files from one upload request processed at the same time
+UPLOAD_MAX_CONCURRENT_FILES = int(os.getenv("UPLOAD_MAX_CONCURRENT_FILES", "4"))
+
+# Columns the frontend's document list uses
+_DOCUMENT_LIST_COLUMNS = (
+    "id", "filename", "original_filename", "team", "project", "file_type",
+    "file_size", "status", "upload_date", "chunk_count"
+)
+
+# Static payloads, serialized once at import
+_ROOT_RESPONSE = orjson.dumps({"message": "HelperGPT API is running", "version": "1.0.0"})
+_TEAMS_RESPONSE = orjson.dumps({"teams": [
+    {
+        "id": 1,
+        "name": "Engineering",
+        "projects": [
+            "Cloud Team",
+            "IT Support",
+            "IRI",
+            "INSW",
+            "Meraki",
+            "Nautilux",
+            "Database",
+            "Custom Project…"
+        ]
+    },
+    {"id": 2, "name": "Marketing", "projects": ["Campaign 2025", "Brand Guidelines", "Social Media"]},
+    {"id": 3, "name": "Sales", "projects": ["Q1 Strategy", "Training Materials", "Product Demos"]},
+    {"id": 4, "name": "HR", "projects": ["Onboarding", "Policies", "Benefits Guide"]}
+]})
+
 app = FastAPI(
     title="HelperGPT API",
     description="AI-powered internal documentation system",
     version="1.0.0"
 )
 
+# Admin token check (added before CORS so CORS stays the outermost layer)
+app.add_middleware(
+    AdminAuthASGIMiddleware,
+    protected_routes=[
+        ("POST", r"^/documents/upload$"),
+        ("GET", r"^/documents/?$"),
+        ("DELETE", r"^/documents/[^/]+$"),
+    ]
+)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -42,9 +88,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Security
-security = HTTPBearer()
-
 @app.on_event("startup")
 async def startup_event():
     """Initialize database and create required directories on startup"""
@@ -66,15 +109,29 @@ async def startup_event():
     
     logger.info("Application startup complete")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Save unsaved index changes, stop extraction workers and close the shared database connection on shutdown"""
+    try:
+        from embeddings import embedding_manager
+        await embedding_manager.flush()
+    except Exception as e:
+        logger.error(f"Failed to save embedding index: {str(e)}")
+    shutdown_extract_pool()
+    await close_db()
+
 @app.get("/")
 async def root():
     """Root endpoint"""
-    return {"message": "HelperGPT API is running", "version": "1.0.0"}
+    return Response(content=_ROOT_RESPONSE, media_type="application/json")
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return Response(
+        content=b'{"status":"healthy","timestamp":"' + datetime.now().isoformat().encode() + b'"}',
+        media_type="application/json"
+    )
 
 @app.post("/auth/login")
 async def login(request: LoginRequest):
@@ -98,66 +155,75 @@ async def login(request: LoginRequest):
         logger.error(f"Login error: {str(e)}")
         raise HTTPException(status_code=500, detail="Login failed")
 
+async def _process_uploaded_file(file: UploadFile, team: str, project: str) -> Optional[dict]:
+    """Save, extract and index one uploaded file; None if it was skipped"""
+    try:
+        # Validate file type
+        if not file.filename.lower().endswith(('.txt', '.pdf', '.doc', '.docx')):
+            logger.warning(f"Skipping unsupported file: {file.filename}")
+            return None
+        
+        logger.info(f"Processing file: {file.filename}")
+        
+        # Save file
+        file_path = await save_uploaded_file(file, team, project)
+        logger.info(f"File saved to: {file_path}")
+        
+        # Extract text and process embeddings
+        text_content = await extract_text_from_file(file_path)
+        if not text_content:
+            logger.warning(f"No text extracted from {file.filename}")
+            return None
+        
+        logger.info(f"Extracted {len(text_content)} characters from {file.filename}")
+        
+        document_id = await process_document(file.filename, text_content, team, project, file_size=file.size)
+        
+        logger.info(f"Successfully processed {file.filename} with ID {document_id}")
+        return {
+            "filename": file.filename,
+            "team": team,
+            "project": project,
+            "document_id": document_id,
+            "status": "processed"
+        }
+        
+    except Exception as file_error:
+        logger.error(f"Error processing file {file.filename}: {str(file_error)}")
+        return {
+            "filename": file.filename,
+            "team": team,
+            "project": project,
+            "document_id": None,
+            "status": "error",
+            "error": str(file_error)
+        }
+
 @app.post("/documents/upload")
 async def upload_documents(
+    request: Request,
     files: List[UploadFile] = File(...),
     team: str = Form(...),
-    project: str = Form(...),
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    project: str = Form(...)
 ):
     """Upload and process documents"""
     try:
-        # Verify admin token
-        user = await verify_token(credentials.credentials)
-        if not user or user.get("role") != "admin":
-            raise HTTPException(status_code=403, detail="Admin access required")
-        
-        logger.info(f"Starting upload for {len(files)} files - Team: {team}, Project: {project}")
-        uploaded_files = []
-        
-        for file in files:
-            try:
-                # Validate file type
-                if not file.filename.lower().endswith(('.txt', '.pdf', '.doc', '.docx')):
-                    logger.warning(f"Skipping unsupported file: {file.filename}")
-                    continue
-                
-                logger.info(f"Processing file: {file.filename}")
-                
-                # Save file
-                file_path = await save_uploaded_file(file, team, project)
-                logger.info(f"File saved to: {file_path}")
-                
-                # Extract text and process embeddings
-                text_content = await extract_text_from_file(file_path)
-                if not text_content:
-                    logger.warning(f"No text extracted from {file.filename}")
-                    continue
-                
-                logger.info(f"Extracted {len(text_content)} characters from {file.filename}")
-                
-                document_id = await process_document(file.filename, text_content, team, project)
-                
-                uploaded_files.append({
-                    "filename": file.filename,
-                    "team": team,
-                    "project": project,
-                    "document_id": document_id,
-                    "status": "processed"
-                })
-                
-                logger.info(f"Successfully processed {file.filename} with ID {document_id}")
-                
-            except Exception as file_error:
-                logger.error(f"Error processing file {file.filename}: {str(file_error)}")
-                uploaded_files.append({
-                    "filename": file.filename,
-                    "team": team,
-                    "project": project,
-                    "document_id": None,
-                    "status": "error",
-                    "error": str(file_error)
-                })
+        user = request.state.user
+        logger.info(f"Starting upload for {len(files)} files by {user['username']} - Team: {team}, Project: {project}")
+        
+        # Files are saved, extracted and embedded concurrently, a few at a time
+        semaphore = asyncio.Semaphore(UPLOAD_MAX_CONCURRENT_FILES)
+        
+        async def process_bounded(file: UploadFile):
+            async with semaphore:
+                return await _process_uploaded_file(file, team, project)
+        
+        results = await asyncio.gather(*[process_bounded(file) for file in files])
+        uploaded_files = [result for result in results if result is not None]
+        
+        # Cached answers may not reflect the new documents
+        if any(f.get("status") == "processed" for f in uploaded_files):
+            semantic_cache.clear()
         
         return {
             "uploaded_files": uploaded_files, 
@@ -174,8 +240,28 @@ async def ask_question(request: QuestionRequest):
     try:
         logger.info(f"Processing question: '{request.question}'")
         
-        # Search for relevant documents
-        similar_docs = await search_similar_documents(request.question, limit=5)
+        # One embedding serves both the semantic cache and the document search
+        try:
+            query_vector = await get_query_vector(request.question)
+        except Exception as e:
+            logger.error(f"Error embedding question: {str(e)}")
+            query_vector = None
+        
+        if query_vector is not None:
+            cached = semantic_cache.lookup(query_vector)
+            if cached is not None:
+                logger.info("Answered from semantic cache")
+                return cached.model_copy(update={"question": request.question, "timestamp": datetime.now()})
+        
+        # Search for relevant documents; an answer given without them is not worth caching
+        retrieval_failed = False
+        try:
+            similar_docs = await search_similar_documents(
+                request.question, limit=5, query_vector=query_vector, raise_errors=True
+            )
+        except Exception:
+            similar_docs = []
+            retrieval_failed = True
         logger.info(f"Found {len(similar_docs)} similar documents")
         
         # Generate AI response
@@ -191,6 +277,9 @@ async def ask_question(request: QuestionRequest):
         )
         
         logger.info(f"Generated response with {len(ai_response['sources'])} sources, confidence: {ai_response['confidence']}")
+        # Cache only real answers, so a retry after an outage isn't served the failure
+        if query_vector is not None and not retrieval_failed and ai_response.get("response_type") != "error":
+            semantic_cache.insert(query_vector, response)
         return response
         
     except Exception as e:
@@ -200,54 +289,15 @@ async def ask_question(request: QuestionRequest):
 @app.get("/documents")
 async def get_documents(
     team: Optional[str] = None,
-    project: Optional[str] = None,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
+    project: Optional[str] = None
 ):
     """Get list of uploaded documents"""
     try:
-        # Verify admin token
-        user = await verify_token(credentials.credentials)
-        if not user or user.get("role") != "admin":
-            raise HTTPException(status_code=403, detail="Admin access required")
-
-        conn = await get_db_connection()
-        
-        # Updated query to select specific columns for consistent structure
-        query = "SELECT id, filename, original_filename, team, project, file_type, file_size, status, upload_date, chunk_count FROM documents"
-        params: List[Any] = []
-        
-        if team:
-            query += " WHERE team = ?"
-            params.append(team)
-        
-        if project:
-            query += " AND project = ?" if team else " WHERE project = ?"
-            params.append(project)
-        
-        query += " ORDER BY upload_date DESC"
-        
-        result = await conn.execute(query, params)
-        rows = await result.fetchall()
-        await conn.close()
-        
-        # Convert to structured format for frontend
-        documents = []
-        for row in rows:
-            documents.append({
-                "id": row[0],
-                "filename": row[1],
-                "original_filename": row[2],
-                "team": row[3],
-                "project": row[4],
-                "file_type": row[5],
-                "file_size": row[6],
-                "status": row[7],
-                "upload_date": row[8],
-                "chunk_count": row[9]
-            })
+        # Rows come back as dicts keyed by column name and are serialized straight to JSON bytes
+        documents = await get_documents_by_team_project(team, project, columns=_DOCUMENT_LIST_COLUMNS)
         
         logger.info(f"Returning {len(documents)} documents")
-        return {"documents": documents}
+        return ORJSONResponse({"documents": documents})
         
     except Exception as e:
         logger.error(f"Get documents error: {str(e)}")
@@ -283,45 +333,31 @@ async def download_document(document_id: int):
         raise HTTPException(status_code=500, detail="Download failed")
 
 @app.delete("/documents/{document_id}")
-async def delete_document(
-    document_id: int,
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-):
+async def delete_document(document_id: int):
     """Delete a document and its associated data"""
     try:
-        # Verify admin token
-        user = await verify_token(credentials.credentials)
-        if not user or user.get("role") != "admin":
-            raise HTTPException(status_code=403, detail="Admin access required")
-
-        # Get document info before deletion
-        document = await get_document_by_id(document_id)
+        # Delete the row and its chunks in one transaction, getting back what's needed for the file
+        document = await pop_document(document_id)
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
         
-        if document:
-            # Delete physical file
-            if document.get("file_path") and os.path.exists(document["file_path"]):
-                file_path = document["file_path"]
-            else:
-                file_path = get_file_path(document["filename"], document["team"], document["project"])
-            
-            await delete_file(file_path)
-            logger.info(f"Deleted physical file: {file_path}")
-            
-            # Delete from database (this also deletes associated chunks due to foreign key constraint)
-            success = await delete_document_by_id(document_id)
-            
-            if success:
-                logger.info(f"Deleted document {document_id} from database")
-                
-                # TODO: Remove embeddings from FAISS index
-                # This requires rebuilding the index or implementing vector removal
-                
-                return {"message": "Document deleted successfully"}
-            else:
-                raise HTTPException(status_code=404, detail="Document not found in database")
+        logger.info(f"Deleted document {document_id} from database")
+        semantic_cache.clear()
+        await remove_document_embeddings(document_id)
+        
+        # Delete physical file
+        if document.get("file_path") and os.path.exists(document["file_path"]):
+            file_path = document["file_path"]
         else:
-            raise HTTPException(status_code=404, detail="Document not found")
+            file_path = get_file_path(document["filename"], document["team"], document["project"])
+        
+        await delete_file(file_path)
+        logger.info(f"Deleted physical file: {file_path}")
+        
+        return {"message": "Document deleted successfully"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Delete error: {str(e)}")
         raise HTTPException(status_code=500, detail="Delete failed")
@@ -329,26 +365,7 @@ async def delete_document(
 @app.get("/teams")
 async def get_teams():
     """Get list of teams and projects"""
-    teams = [
-        {
-            "id": 1,
-            "name": "Engineering",
-            "projects": [
-                "Cloud Team",
-                "IT Support",
-                "IRI",
-                "INSW",
-                "Meraki",
-                "Nautilux",
-                "Database",
-                "Custom Project…"
-            ]
-        },
-        {"id": 2, "name": "Marketing", "projects": ["Campaign 2025", "Brand Guidelines", "Social Media"]},
-        {"id": 3, "name": "Sales", "projects": ["Q1 Strategy", "Training Materials", "Product Demos"]},
-        {"id": 4, "name": "HR", "projects": ["Onboarding", "Policies", "Benefits Guide"]}
-    ]
-    return {"teams": teams}
+    return Response(content=_TEAMS_RESPONSE, media_type="application/json")
 
 @app.get("/debug/processing")
 async def debug_processing():
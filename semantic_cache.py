@@ -0,0 +1,73 @@
+"""
+Semantic cache module for HelperGPT
+Reuses answers to questions whose embeddings nearly match an earlier question
+"""
+import os
+import time
+import logging
+from typing import Any, Optional, Tuple
+from collections import OrderedDict
+import numpy as np
+import faiss
+
+from embeddings import EMBEDDING_DIMENSION
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1024"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+
+class SemanticCache:
+    """Responses keyed by normalized question embeddings, looked up by cosine similarity
+
+    Vectors live in a small exact inner-product index; entries are evicted least recently
+    used first and expire after ttl_seconds.
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, ttl_seconds: float = SEMANTIC_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(EMBEDDING_DIMENSION))
+        # cache id -> (response, monotonic expiry), least recently used first
+        self._entries: "OrderedDict[int, Tuple[Any, float]]" = OrderedDict()
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, entry_id: int):
+        self._entries.pop(entry_id, None)
+        self._index.remove_ids(np.array([entry_id], dtype=np.int64))
+
+    def lookup(self, query_vector: np.ndarray, threshold: float = SEMANTIC_CACHE_THRESHOLD) -> Optional[Any]:
+        """Cached response for the closest question if its similarity is at least threshold"""
+        if not self._entries:
+            return None
+        scores, ids = self._index.search(query_vector, 1)
+        entry_id = int(ids[0][0])
+        entry = self._entries.get(entry_id)
+        if entry is None or scores[0][0] < threshold:
+            return None
+        response, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(entry_id)
+            return None
+        self._entries.move_to_end(entry_id)
+        return response
+
+    def insert(self, query_vector: np.ndarray, response: Any):
+        """Cache a response under a normalized (1, d) question vector"""
+        entry_id = self._next_id
+        self._next_id += 1
+        self._index.add_with_ids(query_vector, np.array([entry_id], dtype=np.int64))
+        self._entries[entry_id] = (response, time.monotonic() + self.ttl_seconds)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """Forget every entry, e.g. after documents change"""
+        self._index.reset()
+        self._entries.clear()
+
+semantic_cache = SemanticCache()
@@ -578,6 +578,7 @@ Generate helpful follow-up questions to diagnose this {category} issue better.""
                     resolved_at TIMESTAMP,
                     escalated BOOLEAN DEFAULT FALSE,
                     email_sent BOOLEAN DEFAULT FALSE,
+                    email_batch_id TEXT,
                     satisfaction_rating INTEGER,
                     tags TEXT
                 )
@@ -9,6 +9,8 @@ import logging
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import PyPDF2
 import docx
@@ -34,23 +36,54 @@ azure_openai_client = AsyncAzureOpenAI(
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
 
+# Text extraction is CPU-bound parsing, so it runs in worker processes instead of on the event loop
+EXTRACT_MAX_WORKERS = int(os.getenv("EXTRACT_MAX_WORKERS", str(os.cpu_count() or 1)))
+_extract_pool: Optional[ProcessPoolExecutor] = None
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_CONTROL_CHARS_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]')
+
+def _get_extract_pool() -> ProcessPoolExecutor:
+    global _extract_pool
+    if _extract_pool is None:
+        # spawn rather than fork: the server process has database and HTTP client threads running
+        _extract_pool = ProcessPoolExecutor(
+            max_workers=EXTRACT_MAX_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _extract_pool
+
+def shutdown_extract_pool():
+    """Stop the text extraction worker processes"""
+    global _extract_pool
+    if _extract_pool is not None:
+        _extract_pool.shutdown(wait=False, cancel_futures=True)
+        _extract_pool = None
+
 async def extract_text_from_file(file_path: str) -> str:
+    """Extract text content from various file formats in a worker process"""
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_extract_pool(), _extract_text_sync, file_path)
+    except Exception as e:
+        logger.error(f"Error extracting text from {file_path}: {str(e)}")
+        return ""
+
+def _extract_text_sync(file_path: str) -> str:
     """Extract text content from various file formats"""
     try:
         file_ext = Path(file_path).suffix.lower()
         if file_ext == '.txt':
-            return await extract_text_from_txt(file_path)
+            return extract_text_from_txt(file_path)
         elif file_ext == '.pdf':
-            return await extract_text_from_pdf(file_path)
+            return extract_text_from_pdf(file_path)
         elif file_ext in ['.doc', '.docx']:
-            return await extract_text_from_word(file_path)
+            return extract_text_from_word(file_path)
         else:
             raise ValueError(f"Unsupported file type: {file_ext}")
     except Exception as e:
         logger.error(f"Error extracting text from {file_path}: {str(e)}")
         return ""
 
-async def extract_text_from_txt(file_path: str) -> str:
+def extract_text_from_txt(file_path: str) -> str:
     """Extract text from TXT file"""
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
@@ -60,7 +93,7 @@ async def extract_text_from_txt(file_path: str) -> str:
         logger.error(f"Error reading TXT file: {str(e)}")
         return ""
 
-async def extract_text_from_pdf(file_path: str) -> str:
+def extract_text_from_pdf(file_path: str) -> str:
     """Extract text from PDF file"""
     try:
         text_content = []
@@ -79,7 +112,7 @@ async def extract_text_from_pdf(file_path: str) -> str:
         logger.error(f"Error reading PDF file: {str(e)}")
         return ""
 
-async def extract_text_from_word(file_path: str) -> str:
+def extract_text_from_word(file_path: str) -> str:
     """Extract text from Word document"""
     try:
         doc = docx.Document(file_path)
@@ -120,13 +153,10 @@ def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVE
                 if sentence_end != -1 and sentence_end > start + chunk_size // 2:
                     end = sentence_end + 1
                 else:
-                    para_break = text.rfind('\n\n', end - 200, end)
-                    if para_break != -1 and para_break > start + chunk_size // 2:
-                        end = para_break + 2
-                    else:
-                        word_end = text.rfind(' ', end - 100, end)
-                        if word_end != -1 and word_end > start + chunk_size // 2:
-                            end = word_end
+                    # clean_text folds newlines into spaces, so words are the next boundary
+                    word_end = text.rfind(' ', end - 100, end)
+                    if word_end != -1 and word_end > start + chunk_size // 2:
+                        end = word_end
             
             chunk = text[start:end].strip()
             if chunk:
@@ -146,9 +176,8 @@ def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVE
 def clean_text(text: str) -> str:
     """Clean and normalize text content"""
     try:
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', '', text)
+        text = _WHITESPACE_RE.sub(' ', text)
+        text = _CONTROL_CHARS_RE.sub('', text)
         return text.strip()
     except Exception as e:
         logger.error(f"Error cleaning text: {str(e)}")